@@ -46,6 +46,12 @@ def read_battery_charge():
     power = bus_voltage * current
     return power
 
+def set_battery_charge(charge):
+    # Restore the battery charge, e.g. when resuming from a checkpoint
+    global battery_charge
+    battery_charge = min(max(charge, min_battery_charge), max_battery_charge)
+    return battery_charge
+
 def update_battery_charge(generation, demand):
     # Update the battery charge based on the energy generation and demand.
     global battery_charge, max_battery_charge, min_battery_charge
@@ -0,0 +1,149 @@
+import logging
+import time
+from collections import namedtuple
+import numpy as np
+
+HORIZON = 48 # Half-hour steps to plan ahead (24 hours)
+CAPACITY = 1.0 # Battery capacity in kWh, batteryControl treats a charge of 1.0 as full
+MAX_RATE = 0.5 # Most energy the battery can take or give in one step (kWh)
+EFFICIENCY = 0.95 # One-way charge and discharge efficiency
+GRID_POINTS = 51 # Number of state of charge levels in the dynamic program
+MIN_GRID_POINTS = 11 # Coarsest grid used when the solver runs out of time
+TIME_BUDGET = 0.05 # Seconds allowed per re-plan
+
+# Result of one re-plan: the charge to move to now and the rest of the plan
+Plan = namedtuple('Plan', ['battery_charge', 'battery_flow', 'charges', 'value', 'solve_time', 'grid_points'])
+
+class BatteryOptimiser:
+    """
+    Plan battery charging and discharging over a rolling horizon to maximise currency.
+
+    Each call to plan() solves a dynamic program over a grid of state of charge
+    levels for the next `horizon` steps, using forecasts of demand, generation and
+    price, and returns the first step of the plan. The stage rewards for every
+    (step, level, next level) are computed as one NumPy array and the backward pass
+    only loops over the steps.
+
+    The grid is refined or coarsened between calls so each solve stays within
+    time_budget seconds. A solve still running at the budget is abandoned for one on
+    the coarsest grid, and every solve time is recorded in solve_times.
+    """
+
+    def __init__(self, capacity=CAPACITY, max_rate=MAX_RATE, efficiency=EFFICIENCY, horizon=HORIZON,
+                 grid_points=GRID_POINTS, time_budget=TIME_BUDGET):
+        self.capacity = capacity
+        self.max_rate = max_rate
+        self.efficiency = efficiency
+        self.horizon = horizon
+        self.max_grid_points = grid_points
+        self.grid_points = grid_points
+        self.time_budget = time_budget
+        self.solve_times = [] # Seconds taken by each solve
+        self.overruns = 0 # Number of solves that went over the time budget
+
+    def plan(self, battery_charge, demand, generation, buy_price, sell_price=None):
+        """
+        Plan the battery over the horizon and return the first step.
+
+        Args:
+        battery_charge (float): Current state of charge, 0 to 1.
+        demand (numpy.ndarray): Forecast demand in kWh for the next steps.
+        generation (numpy.ndarray): Forecast generation in kWh for the next steps.
+        buy_price (numpy.ndarray): Price paid per kWh bought in each step.
+        sell_price (numpy.ndarray): Price received per kWh sold, buy_price if not given.
+
+        Returns:
+        Plan: Charge to move to this step, the energy drawn from the household by the
+        battery (negative when discharging), the planned charges and the solve time.
+        """
+        start_time = time.perf_counter()
+        steps = min(self.horizon, len(demand))
+        if steps == 0: # Nothing to plan, keep the charge
+            return Plan(battery_charge, 0.0, np.empty(0), 0.0, 0.0, self.grid_points)
+        demand = np.asarray(demand[:steps], dtype=np.float64)
+        generation = np.asarray(generation[:steps], dtype=np.float64)
+        buy_price = np.asarray(buy_price[:steps], dtype=np.float64)
+        sell_price = buy_price if sell_price is None else np.asarray(sell_price[:steps], dtype=np.float64)
+
+        n = self.grid_points
+        solution = self._solve(battery_charge, generation - demand, buy_price, sell_price, n, start_time + self.time_budget)
+        if solution is None: # Out of time, the coarsest grid solves in well under a millisecond
+            n = MIN_GRID_POINTS
+            solution = self._solve(battery_charge, generation - demand, buy_price, sell_price, n, None)
+        solve_time = time.perf_counter() - start_time
+        self._adapt_grid(solve_time)
+        return Plan(*solution, solve_time, n)
+
+    def _solve(self, battery_charge, surplus, buy_price, sell_price, n, deadline):
+        # Dynamic program over n charge levels, None if the deadline passes before it is solved
+        steps = len(surplus)
+        levels = np.linspace(0.0, self.capacity, n)
+        change = levels[np.newaxis, :] - levels[:, np.newaxis] # Energy stored moving from level i to level j
+        feasible = np.abs(change) <= self.max_rate + 1e-9
+        # Energy the battery draws from (positive) or gives to (negative) the household
+        flow = np.where(change > 0, change / self.efficiency, change * self.efficiency)
+
+        def stage_reward(step, flow):
+            # Reward of each move in a step, positive when the household earns money
+            net = surplus[step] - flow
+            return np.where(net > 0, net * sell_price[step], net * buy_price[step])
+
+        # Energy left at the end of the horizon is worth what it would sell for on average
+        value = levels * self.efficiency * sell_price.mean()
+        policy = np.empty((steps, n), dtype=np.intp)
+        for step in range(steps - 1, 0, -1):
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            total = np.where(feasible, stage_reward(step, flow), -np.inf) + value[np.newaxis, :]
+            policy[step] = np.argmax(total, axis=1)
+            value = total[np.arange(n), policy[step]]
+
+        # The first move starts from the exact charge, so no energy is gained or lost rounding it onto the grid
+        first_change = levels - battery_charge * self.capacity
+        first_flow = np.where(first_change > 0, first_change / self.efficiency, first_change * self.efficiency)
+        total = np.where(np.abs(first_change) <= self.max_rate + 1e-9, stage_reward(0, first_flow), -np.inf) + value
+        level = int(np.argmax(total))
+
+        # Follow the policy forward from the first level
+        path = np.empty(steps, dtype=np.intp)
+        path[0] = level
+        for step in range(1, steps):
+            path[step] = policy[step, path[step - 1]]
+        return float(levels[level] / self.capacity), float(first_flow[level]), levels[path] / self.capacity, float(total[level])
+
+    def _adapt_grid(self, solve_time):
+        # Keep the next solve within the time budget, the cost grows with the square of the grid size
+        self.solve_times.append(solve_time)
+        if solve_time > self.time_budget:
+            self.overruns += 1
+            self.grid_points = max(MIN_GRID_POINTS, int(self.grid_points * 0.7))
+            logging.warning(f"Battery plan took {solve_time * 1000:.1f} ms, over the {self.time_budget * 1000:.0f} ms budget. "
+                            f"Using {self.grid_points} charge levels")
+        elif solve_time < self.time_budget / 4 and self.grid_points < self.max_grid_points:
+            self.grid_points = min(self.max_grid_points, int(self.grid_points * 1.2) + 1)
+
+    def solve_time_summary(self):
+        # Mean, 95th percentile and maximum solve time in milliseconds
+        if not self.solve_times:
+            return {}
+        times = np.array(self.solve_times) * 1000
+        return {'solves': len(times), 'mean_ms': float(times.mean()), 'p95_ms': float(np.percentile(times, 95)),
+                'max_ms': float(times.max()), 'overruns': self.overruns}
+
+if __name__ == "__main__": # Benchmark a day of re-plans with a 48 step horizon
+    from pricing import linear_price
+
+    rng = np.random.default_rng(42)
+    hours = np.arange(48 * 2) / 2
+    demand = 0.2 + 0.3 * np.exp(-((hours % 24 - 19) ** 2) / 4) + rng.uniform(0.0, 0.05, hours.size)
+    generation = np.clip(np.sin((hours % 24 - 6) / 12 * np.pi), 0.0, None) * 0.8
+    price = linear_price(generation + 0.1, demand)
+    optimiser = BatteryOptimiser()
+    battery_charge = 0.5
+    currency = 0.0
+    for step in range(48):
+        plan = optimiser.plan(battery_charge, demand[step:], generation[step:], price[step:])
+        net = generation[step] - demand[step] - plan.battery_flow
+        currency += net * price[step]
+        battery_charge = plan.battery_charge
+    print(f"Currency change over a day: {currency:.3f}, solve times: {optimiser.solve_time_summary()}")
@@ -0,0 +1,75 @@
+import calendar
+import pandas as pd # type: ignore
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTHS = calendar.month_name[1:]
+
+@pd.api.extensions.register_dataframe_accessor("calendar")
+class CalendarAccessor:
+    """
+    Calendar features of a frame indexed by reading time, computed only when accessed.
+
+    load_data keeps just the DatetimeIndex and the numeric columns, so features such
+    as the weekday or the seconds since midnight are derived from the index on demand:
+
+        df.calendar.day_seconds
+        df.calendar.weekday
+    """
+
+    def __init__(self, df):
+        if not isinstance(df.index, pd.DatetimeIndex):
+            raise AttributeError("The calendar accessor needs a frame with a DatetimeIndex")
+        self._df = df
+        self._index = df.index
+
+    def _series(self, values, name):
+        return pd.Series(values, index=self._index, name=name)
+
+    @property
+    def date(self):
+        # Midnight of each reading, kept as datetime64 rather than Python date objects
+        return self._series(self._index.normalize(), 'date')
+
+    @property
+    def day_of_year(self):
+        return self._series(self._index.dayofyear.astype('int16'), 'day_of_year')
+
+    @property
+    def day_of_month(self):
+        return self._series(self._index.day.astype('int8'), 'day_of_month')
+
+    @property
+    def month(self):
+        return self._series(pd.Categorical.from_codes(self._index.month - 1, categories=MONTHS, ordered=True), 'month')
+
+    @property
+    def weekday(self):
+        return self._series(pd.Categorical.from_codes(self._index.dayofweek, categories=WEEKDAYS, ordered=True), 'weekday')
+
+    @property
+    def time(self):
+        return self._series(self._index.strftime('%X'), 'time')
+
+    @property
+    def day_seconds(self):
+        # Seconds from midnight
+        return self._series((self._index - self._index.normalize()).total_seconds().astype('float32'), 'day_seconds')
+
+    @property
+    def n_days(self):
+        # Number of distinct days covered by the frame
+        return self._index.normalize().nunique()
+
+    def cumulative_sum(self, column='energy'):
+        # Running total of a column within each day (and household, if there are several)
+        keys = [self.date]
+        if 'household' in self._df:
+            keys.append(self._df['household'])
+        return self._df.groupby(keys, observed=True)[column].cumsum().rename('cumulative_sum')
+
+    def frame(self, columns=('date', 'month', 'day_of_month', 'time', 'weekday', 'day_seconds')):
+        """
+        Return a derived view with the requested calendar columns next to the data.
+        """
+        features = {name: getattr(self, name) for name in columns}
+        return self._df.assign(**features)
@@ -0,0 +1,109 @@
+import logging
+import os
+import struct
+import numpy as np
+
+CHECKPOINT_DIR = os.environ.get('SOLARVILLE_CHECKPOINT_DIR', 'checkpoints') # Directory holding the checkpoint files
+
+MAGIC = b'SVCKPT02' # Identifies a checkpoint file and its layout
+HEADER_SIZE = 256 # Fixed size header holding the magic and the run description
+
+# One fixed size record is appended per step, skipped steps included so a run resumes past them
+RECORD_DTYPE = np.dtype([
+    ('step', '<i8'), # Position of the step in the simulation data
+    ('timestamp', '<i8'), # Simulated time in nanoseconds since the epoch
+    ('demand', '<f8'),
+    ('generation', '<f8'),
+    ('balance', '<f8'),
+    ('battery_charge', '<f8'),
+    ('currency', '<f8'),
+    ('skipped', '?'), # Skipped by the clock to catch up, the state is carried over from the previous step
+])
+
+def checkpoint_path(household, start_date, timescale, weather, checkpoint_dir=CHECKPOINT_DIR):
+    # One checkpoint file per simulation run configuration
+    return os.path.join(checkpoint_dir, f"{household}_{start_date}_{timescale}_{weather}.ckpt")
+
+def _run_header(run_info):
+    description = ';'.join(f"{key}={run_info[key]}" for key in sorted(run_info)).encode()
+    if len(MAGIC) + 2 + len(description) > HEADER_SIZE:
+        raise ValueError("Run description too long for the checkpoint header")
+    return (MAGIC + struct.pack('<H', len(description)) + description).ljust(HEADER_SIZE, b'\0')
+
+def load_checkpoint(path, run_info):
+    """
+    Read the steps recorded in a checkpoint file.
+
+    A partially written record at the end of the file, left by a crash mid-write, is ignored.
+
+    Args:
+    path (str): Path to the checkpoint file.
+    run_info (dict): Description of the run, which must match the one in the file.
+
+    Returns:
+    numpy.ndarray: Structured array of RECORD_DTYPE records, empty if there is no usable checkpoint.
+    """
+    empty = np.empty(0, dtype=RECORD_DTYPE)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return empty
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if header != _run_header(run_info):
+        logging.warning(f"Checkpoint {path} belongs to a different run, ignoring it")
+        return empty
+    n_records = (size - HEADER_SIZE) // RECORD_DTYPE.itemsize # Drop a trailing partial record
+    if n_records <= 0:
+        return empty
+    records = np.fromfile(path, dtype=RECORD_DTYPE, count=n_records, offset=HEADER_SIZE)
+    # Steps are written in order, keep the contiguous run from the first step
+    contiguous = np.flatnonzero(records['step'] != records['step'][0] + np.arange(n_records))
+    if contiguous.size:
+        records = records[:contiguous[0]]
+    return records
+
+class CheckpointWriter:
+    """
+    Append-only writer for the per-step results of a simulation run.
+
+    Records are buffered in memory and written and synced to disk every
+    `interval` steps, so a checkpoint costs one write per interval rather than
+    one per step.
+    """
+
+    def __init__(self, path, run_info, interval=10, resume_step=0):
+        self.path = path
+        self.interval = max(1, int(interval))
+        self._buffer = np.empty(self.interval, dtype=RECORD_DTYPE)
+        self._pending = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        header = _run_header(run_info)
+
+        if resume_step > 0 and os.path.exists(path):
+            # Rewind to the agreed resume step, dropping any records after it
+            self._file = open(path, 'r+b')
+            self._file.truncate(HEADER_SIZE + resume_step * RECORD_DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(header)
+            self._file.flush()
+
+    def append(self, step, timestamp, demand, generation, balance, battery_charge, currency, skipped=False):
+        self._buffer[self._pending] = (step, timestamp.value, demand, generation, balance, battery_charge, currency, skipped)
+        self._pending += 1
+        if self._pending == self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending == 0:
+            return
+        self._file.write(self._buffer[:self._pending].tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno()) # Make sure the checkpoint survives a power cut
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
@@ -0,0 +1,302 @@
+import logging
+from collections import namedtuple
+import numpy as np
+import pandas as pd # type: ignore
+from batteryOptimiser import CAPACITY, MAX_RATE, EFFICIENCY
+from dataAnalysis import load_data, calculate_end_date
+from market import EPSILON, OrderBook, clear_timestep, limit_prices, settle
+from pricing import P_MAX, P_MIN, linear_price, sdr_price, supply_and_demand
+from solarGeneration import INTERVAL_SECONDS, generate_solar, size_panels
+from trading import bilateral_trade
+import dataCache
+
+MARKETS = ['pool', 'book']
+PRICES = {'linear': linear_price, 'sdr': sdr_price}
+MAX_SHIFT = 2 # Virtual households copied from a meter household shift its readings by up to this many steps
+SCALE_SIGMA = 0.2 # Spread of the demand scale of virtual households (log-normal)
+
+# Aggregate of one step over all virtual households
+CommunityStep = namedtuple('CommunityStep', ['timestamp', 'demand', 'generation', 'balance', 'battery_charge',
+                                             'currency', 'price', 'traded', 'live_traded'])
+
+HISTORY_DTYPE = np.dtype([
+    ('timestamp', 'i8'), # Start of the step in ns since the epoch
+    ('demand', 'f8'), # Total demand in kWh
+    ('generation', 'f8'), # Total generation in kWh
+    ('balance', 'f8'), # Energy exchanged with the grid after trading, positive when exported
+    ('battery_charge', 'f8'), # Mean state of charge
+    ('currency', 'f8'), # Mean currency per household
+    ('price', 'f8'), # Price of the community trades, NaN without trades
+    ('traded', 'f8'), # Energy traded between virtual households in kWh
+    ('live_traded', 'f8'), # Energy traded with the live members in kWh, positive when sold to them
+])
+
+class Community:
+    """
+    A street of virtual households advanced one step at a time as NumPy arrays.
+
+    Demand and generation are (steps, households) arrays prepared up front, and the
+    battery state of charge and currency are one array each, so a step costs a few
+    vectorised operations whatever the number of households. Each step:
+
+    1. Batteries charge from surpluses and cover deficits, limited by capacity, rate and efficiency.
+    2. Households trade their remaining balances, either in a pool (market='pool') or in
+       the order book of market.py with limit prices set by each battery's state of
+       charge (market='book'). The pool price comes from pricing over the step's supply
+       and demand, live members included, held between P_MIN and P_MAX so it does not
+       grow with the size of the street.
+    3. Live members, the physical Pis, trade against the community's remaining surplus
+       or deficit at the pool price, shared pro rata between the virtual households on
+       that side. The community publishes this price with its balance for the Pis to settle at.
+
+    Whatever is left is exchanged with the grid.
+    """
+
+    def __init__(self, timestamps, demand, generation, capacity=CAPACITY, max_rate=MAX_RATE, efficiency=EFFICIENCY,
+                 battery_charge=0.5, currency=100.0, market='pool', price='linear', seed=42):
+        if market not in MARKETS:
+            raise ValueError(f"Invalid market '{market}'. Use one of: {', '.join(MARKETS)}.")
+        if price not in PRICES:
+            raise ValueError(f"Invalid price '{price}'. Use one of: {', '.join(PRICES)}.")
+        self.timestamps = pd.DatetimeIndex(timestamps)
+        self.demand = np.ascontiguousarray(demand, dtype=np.float32) # Rows are steps, so a step reads one contiguous row
+        self.generation = np.ascontiguousarray(generation, dtype=np.float32)
+        self.n_households = self.demand.shape[1]
+        self.capacity = capacity
+        self.max_rate = max_rate
+        self.efficiency = efficiency
+        self.battery_charge = np.full(self.n_households, battery_charge)
+        self.currency = np.full(self.n_households, currency)
+        self.market = market
+        self.price_function = PRICES[price]
+        self.rng = np.random.default_rng(seed)
+        self._book = OrderBook() if market == 'book' else None
+        self.step_index = 0
+        self.history = np.zeros(len(self.timestamps), dtype=HISTORY_DTYPE)
+        self.published_balance = 0.0 # Community balance the live members trade against
+        self.published_price = float(np.clip(self.price_function(0.0, 0.0), P_MIN, P_MAX)) # and the price they trade at
+
+    @classmethod
+    def from_meter_data(cls, file_path, households, start_date, timescale, n_households=None, weather='normal',
+                        seed=42, use_cache=True, **kwargs):
+        """
+        Build a community from the smart meter data of a few households.
+
+        Each meter household is included as it is, and further virtual households copy
+        one of them with its readings shifted by up to MAX_SHIFT steps and its demand
+        scaled, so a block of the dataset can stand for a street of any size. Panels are
+        sized from each household's demand and share the neighbourhood's weather.
+
+        Args:
+        file_path (str): Path to the CSV file.
+        households (list): Household IDs to read from the file.
+        start_date (str): Start date for the simulation in 'YYYY-MM-DD' format.
+        timescale (str): Timescale for the simulation ('d', 'w', 'm', 'y').
+        n_households (int): Number of virtual households, the number of meter households if not given.
+        weather (str): Weather mode for the generation.
+        seed (int): Seed for the virtual households and the generation.
+        use_cache (bool): Whether to read and write the prepared data cache.
+        **kwargs: Passed on to Community.
+
+        Returns:
+        Community: The community at its first step.
+        """
+        households = list(households)
+        def build():
+            return load_data(file_path, households, start_date, timescale)
+        df = (dataCache.cached_frame(build, file_path, households=households, start_date=start_date,
+                                     timescale=timescale, kind='meter') if use_cache else build())
+        if df.empty:
+            raise ValueError(f"No meter data for households {households} from {start_date}")
+
+        timestamps = pd.date_range(start_date, calculate_end_date(start_date, timescale), freq=f'{INTERVAL_SECONDS}s', inclusive='left')
+        meter = meter_matrix(df, timestamps)
+        n_households = n_households or meter.shape[1]
+        rng = np.random.default_rng(seed)
+        demand = virtual_households(meter, n_households, rng)
+
+        days = len(timestamps) * INTERVAL_SECONDS / 86400
+        panel_kwp = size_panels(demand.sum(axis=0, dtype=np.float64) * 365 / days)
+        day_seconds = (timestamps - timestamps.normalize()).total_seconds().to_numpy()
+        generation = generate_solar(timestamps.dayofyear.to_numpy(), day_seconds, np.atleast_1d(panel_kwp), weather=weather, seed=seed)
+        logging.info(f"Community of {n_households} households from {meter.shape[1]} meter households over {len(timestamps)} steps")
+        return cls(timestamps, demand, generation, seed=seed, **kwargs)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def step(self, live_balances=None):
+        """
+        Advance every household by one step.
+
+        Args:
+        live_balances (dict): Latest balance of each live member, by IP.
+
+        Returns:
+        tuple: CommunityStep aggregate and a dict of the trades with the live members,
+        IP to (energy, price) with the energy positive when the community sells.
+        """
+        t = self.step_index
+        if t >= len(self.timestamps):
+            raise IndexError("The community has no steps left")
+        demand = self.demand[t].astype(np.float64)
+        generation = self.generation[t].astype(np.float64)
+
+        # Batteries take surpluses and cover deficits first
+        net = generation - demand
+        soc = self.battery_charge
+        stored = np.minimum(np.clip(net, 0.0, self.max_rate) * self.efficiency, (1.0 - soc) * self.capacity)
+        given = np.minimum(np.clip(-net, 0.0, self.max_rate), soc * self.capacity * self.efficiency)
+        soc += (stored - given / self.efficiency) / self.capacity
+        np.clip(soc, 0.0, 1.0, out=soc)
+        balance = net - stored / self.efficiency + given
+        balance[np.abs(balance) < EPSILON] = 0.0 # Rounding left over when a battery takes the whole surplus
+
+        # One price per step from all balances, the live members' included, held between P_MIN and P_MAX
+        live_balances = live_balances or {}
+        supply, wanted = supply_and_demand(np.concatenate((balance, list(live_balances.values()))))
+        self.published_price = float(np.clip(self.price_function(supply, wanted), P_MIN, P_MAX))
+
+        if self.market == 'pool':
+            traded, price = self._trade_pool(balance, self.published_price)
+        else:
+            traded, price = self._trade_book(balance, t)
+
+        # The live members see the community's net balance, as they would see a peer Pi's, and the price it sets
+        self.published_balance = float(balance.sum())
+        live_trades = {}
+        live_traded = 0.0
+        for member, member_balance in live_balances.items():
+            amount = self._trade_live(balance, member_balance)
+            if amount:
+                live_trades[member] = (amount, self.published_price)
+                live_traded += amount
+
+        record = self.history[t]
+        record['timestamp'] = self.timestamps[t].value
+        record['demand'] = demand.sum()
+        record['generation'] = generation.sum()
+        record['balance'] = balance.sum()
+        record['battery_charge'] = soc.mean()
+        record['currency'] = self.currency.mean()
+        record['price'] = price
+        record['traded'] = traded
+        record['live_traded'] = live_traded
+        self.step_index += 1
+        return CommunityStep(self.timestamps[t], *(record[name].item() for name in HISTORY_DTYPE.names[1:])), live_trades
+
+    def _trade_pool(self, balance, price):
+        # Match total supply against total demand at the step's price, filling each side pro rata
+        supply, wanted = supply_and_demand(balance)
+        traded = min(supply, wanted)
+        if traded <= 0:
+            return 0.0, np.nan
+        sold = np.where(balance > 0, balance * (traded / supply), 0.0)
+        bought = np.where(balance < 0, -balance * (traded / wanted), 0.0)
+        self.currency += (sold - bought) * price
+        balance -= sold - bought
+        return float(traded), price
+
+    def _trade_book(self, balance, t):
+        # Households submit their balances in a random order at limit prices set by their batteries
+        trades = clear_timestep(balance, limit_prices(self.battery_charge), timestamp=t,
+                                order=self.rng.permutation(self.n_households), book=self._book)
+        if not len(trades):
+            return 0.0, np.nan
+        energy, currency = settle(trades, self.n_households)
+        balance += energy
+        self.currency += currency
+        traded = float(trades['quantity'].sum())
+        return traded, float((trades['quantity'] * trades['price']).sum() / traded)
+
+    def _trade_live(self, balance, member_balance):
+        # Trade with a live member against the households on the opposite side at the published price, shared pro rata
+        side = balance > 0 if member_balance < 0 else balance < 0
+        available = float(balance[side].sum())
+        amount, price = bilateral_trade(available, member_balance, self.published_price)
+        if amount:
+            share = balance[side] * (amount / available)
+            balance[side] -= share
+            self.currency[side] += share * price
+        return amount
+
+    def frame(self):
+        """
+        Return the steps taken so far as a data frame indexed by time.
+
+        The columns follow the single-household simulation (energy is the demand), so the
+        frame can be stored with resultsStore.ResultsStore.append_run.
+        """
+        history = self.history[:self.step_index]
+        return pd.DataFrame({'energy': history['demand'], 'generation': history['generation'],
+                             'balance': history['balance'], 'currency': history['currency'],
+                             'battery_charge': history['battery_charge'], 'price': history['price'],
+                             'traded': history['traded'], 'live_traded': history['live_traded']},
+                            index=pd.DatetimeIndex(history['timestamp'], name='datetime'))
+
+def meter_matrix(df, timestamps):
+    """
+    Arrange meter readings as a (steps, households) array.
+
+    Missing readings are filled with the household's mean, and households without any
+    reading in the range are left out.
+
+    Args:
+    df (pandas.DataFrame): Frame returned by load_data for one or more households.
+    timestamps (pandas.DatetimeIndex): Start of each step.
+
+    Returns:
+    numpy.ndarray: float32 demand in kWh per step.
+    """
+    rows = timestamps.get_indexer(df.index)
+    codes = df['household'].cat.codes.to_numpy()
+    valid = (rows >= 0) & (codes >= 0)
+    matrix = np.full((len(timestamps), len(df['household'].cat.categories)), np.nan, dtype=np.float32)
+    matrix[rows[valid], codes[valid]] = df['energy'].to_numpy()[valid]
+    matrix = matrix[:, ~np.isnan(matrix).all(axis=0)]
+    return np.where(np.isnan(matrix), np.nanmean(matrix, axis=0), matrix).astype(np.float32)
+
+def virtual_households(meter, n_households, rng):
+    """
+    Derive n_households demand profiles from the meter households.
+
+    The first virtual households are the meter households themselves, the rest copy one
+    of them, shifted in time by up to MAX_SHIFT steps and scaled.
+
+    Returns:
+    numpy.ndarray: float32 (steps, n_households) demand in kWh.
+    """
+    n_steps, n_meter = meter.shape
+    source = np.arange(n_households) % n_meter
+    shift = rng.integers(-MAX_SHIFT, MAX_SHIFT + 1, n_households)
+    scale = rng.lognormal(0.0, SCALE_SIGMA, n_households).astype(np.float32)
+    shift[:n_meter] = 0
+    scale[:n_meter] = 1.0
+    rows = (np.arange(n_steps)[:, np.newaxis] - shift) % n_steps
+    return meter[rows, source] * scale
+
+if __name__ == "__main__": # Benchmark a week of a 1,000 household street
+    import time
+
+    rng = np.random.default_rng(42)
+    timestamps = pd.date_range('2013-06-01', periods=7 * 48, freq='30min')
+    hours = (timestamps.hour + timestamps.minute / 60).to_numpy()
+    profile = 0.15 + 0.25 * np.exp(-((hours - 19) ** 2) / 4) # Evening peak, kWh per half hour
+    meter = (profile[:, np.newaxis] * rng.lognormal(0.0, 0.3, (1, 50)) + rng.uniform(0.0, 0.05, (len(timestamps), 50))).astype(np.float32)
+    n_households = 1000
+    demand = virtual_households(meter, n_households, rng)
+    day_seconds = (timestamps - timestamps.normalize()).total_seconds().to_numpy()
+    generation = generate_solar(timestamps.dayofyear.to_numpy(), day_seconds, size_panels(demand.sum(axis=0) * 365 / 7))
+    live = {'192.168.1.10': 0.2, '192.168.1.11': -0.3} # Two physical Pis
+
+    for market in MARKETS:
+        community = Community(timestamps, demand, generation, market=market)
+        step_times = np.empty(len(community))
+        for t in range(len(community)):
+            start_time = time.perf_counter()
+            community.step(live)
+            step_times[t] = time.perf_counter() - start_time
+        step_ms = step_times * 1000
+        print(f"{market:>4}: {n_households} households x {len(community)} steps, mean {step_ms.mean():.2f} ms, "
+              f"max {step_ms.max():.2f} ms per step, mean currency {community.currency.mean():.2f}")
+    print(f"A step is due every {INTERVAL_SECONDS / 600:.0f} s at the default 600x clock speed")
@@ -1,11 +1,25 @@
-import netifaces # type: ignore
+import functools
+import logging
+import socket
 
 PI_1_IP = '10.126.46.162'  # IP of Pi 1
 PI_2_IP = '10.126.50.50'  # IP of Pi 2
 
 def get_network_ip():
     # Get the non-loopback IP address of the machine.
+    # Connecting a UDP socket picks the outgoing interface without sending anything
     try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((PI_1_IP, 5000))
+            ip = s.getsockname()[0]
+            if ip != '127.0.0.1' and ip != '0.0.0.0':
+                logging.info(f"Network IP: {ip}")
+                return ip
+    except OSError:
+        pass # No route, fall back to listing the interfaces
+
+    try:
+        import netifaces # type: ignore
         # Get all network interfaces
         interfaces = netifaces.interfaces()
         for interface in interfaces:
@@ -16,21 +30,32 @@ def get_network_ip():
             if netifaces.AF_INET in addrs:
                 ip = addrs[netifaces.AF_INET][0]['addr']
                 if ip != '127.0.0.1':
-                    print(f"Network IP: {ip}")
+                    logging.info(f"Network IP: {ip}")
                     return ip
     except Exception as e:
-        print(f"Error getting network IP: {e}")
+        logging.error(f"Error getting network IP: {e}")
     return None
 
-def get_local_and_peer_ip():
-    local_ip = get_network_ip()
-    if local_ip:
-        if local_ip == PI_1_IP:
-            return PI_1_IP, PI_2_IP
-        elif local_ip == PI_2_IP:
-            return PI_2_IP, PI_1_IP
+@functools.lru_cache(maxsize=None)
+def discover_ips():
+    """
+    Find this Pi's IP and its peer's IP. The result is cached after the first call.
 
-LOCAL_IP, PEER_IP = get_local_and_peer_ip()
+    Returns:
+    tuple: Local IP and peer IP, (None, None) if this machine is neither Pi.
+    """
+    local_ip = get_network_ip()
+    if local_ip == PI_1_IP:
+        return PI_1_IP, PI_2_IP
+    elif local_ip == PI_2_IP:
+        return PI_2_IP, PI_1_IP
+    logging.warning(f"Local IP {local_ip} is not one of the configured Pis, no peer available")
+    return None, None
 
-print(f"Local IP: {LOCAL_IP}")
-print(f"Peer IP: {PEER_IP}")
+def __getattr__(name):
+    # Keep `from config import LOCAL_IP, PEER_IP` working, discovering the IPs on first use
+    if name == 'LOCAL_IP':
+        return discover_ips()[0]
+    if name == 'PEER_IP':
+        return discover_ips()[1]
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
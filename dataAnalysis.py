@@ -1,20 +1,23 @@
 import pandas as pd # type: ignore
-import numpy as np
-import matplotlib.pyplot as plt # type: ignore
-import matplotlib.dates as mdates # type: ignore
 from datetime import datetime, timedelta
-import calendar
 import logging
 import time
+from solarGeneration import generate_solar, size_panels
+import dataCache
+import calendarFeatures # noqa: F401 (registers the df.calendar accessor)
 
 # Function to load and preprocess data
-def load_data(file_path, household, start_date, timescale, chunk_size=10000):
+def load_data(file_path, household, start_date, timescale, chunk_size=100000):
     """
     Load and preprocess data from a CSV file.
 
+    The frame is kept lean: the reading time as a DatetimeIndex, float32 energy and
+    categorical household codes. Calendar features such as the weekday or seconds
+    since midnight are computed on access through df.calendar (see calendarFeatures).
+
     Args:
     file_path (str): Path to the CSV file.
-    household (str): Household ID to filter the data.
+    household (str or list): Household ID, or list of IDs, to filter the data.
     start_date (str): Start date for analysis in 'YYYY-MM-DD' format.
     timescale (str): Timescale for analysis ('d', 'w', 'm', 'y').
     chunk_size (int): Number of rows to process at a time.
@@ -25,38 +28,32 @@ def load_data(file_path, household, start_date, timescale, chunk_size=10000):
     start_time = time.time()
     start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
     end_date_obj = calculate_end_date(start_date, timescale)
+    households = [household] if isinstance(household, str) else list(household)
     
     filtered_chunks = []
     chunks_with_data = 0
     total_chunks = 0
     
-    # Process the CSV file in chunks
-    for chunk in pd.read_csv(file_path, chunksize=chunk_size): # Read the CSV file in chunks
+    # Process the CSV file in chunks, only parsing the columns we keep
+    reader = pd.read_csv(file_path, chunksize=chunk_size, usecols=["LCLid", "tstp", "energy(kWh/hh)"],
+                         dtype={"LCLid": "category", "energy(kWh/hh)": "float32"}, na_values=["Null"])
+    for chunk in reader: # Read the CSV file in chunks
         total_chunks += 1 # Increment the total number of chunks
-        chunk = chunk[chunk["LCLid"] == household] # Filter data for the specified household
-        chunk['datetime'] = pd.to_datetime(chunk['tstp'].str.replace('.0000000', '')) # Convert 'tstp' to datetime format
-        chunk = chunk[(chunk['datetime'] >= start_date_obj) & (chunk['datetime'] < end_date_obj)] # Filter data for the specified date range
-        
-        # Preprocess the data
-        if not chunk.empty: # Check if the chunk has data
+        chunk = chunk[chunk["LCLid"].isin(households)] # Filter data for the specified households
+        if chunk.empty:
+            logging.debug(f"No data found in chunk {total_chunks} for household {household} and date range {start_date} to {end_date_obj}")
+            continue
+        datetime_index = pd.to_datetime(chunk['tstp'].str.slice(0, 19), format="%Y-%m-%d %H:%M:%S") # Convert 'tstp' to datetime, dropping the fractional seconds
+        in_range = ((datetime_index >= start_date_obj) & (datetime_index < end_date_obj)).to_numpy() # Filter data for the specified date range
+        energy = chunk["energy(kWh/hh)"].to_numpy()[in_range]
+        valid = ~pd.isna(energy) # Remove rows with missing energy data
+
+        if valid.any(): # Check if the chunk has data
             chunks_with_data += 1 # Increment the number of chunks with data
-            chunk['date'] = chunk['datetime'].dt.date # Extract date from datetime
-            chunk['month'] = chunk['datetime'].dt.strftime("%B") # Extract month from datetime
-            chunk['day_of_month'] = chunk['datetime'].dt.strftime("%d") # Extract day of the month from datetime
-            chunk['time'] = chunk['datetime'].dt.strftime('%X') # Extract time from datetime
-            chunk['weekday'] = chunk['datetime'].dt.strftime('%A') # Extract weekday from datetime
-            chunk['day_seconds'] = (chunk['datetime'] - chunk['datetime'].dt.normalize()).dt.total_seconds() # Extract seconds from midnight
-
-            # Convert weekday and month to categorical data for proper ordering
-            chunk['weekday'] = pd.Categorical(chunk['weekday'], categories=['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], ordered=True)
-            chunk['month'] = pd.Categorical(chunk['month'], categories=calendar.month_name[1:], ordered=True)
-
-            # Process energy data
-            chunk = chunk[chunk["energy(kWh/hh)"] != "Null"] # Remove rows with missing energy data
-            chunk["energy"] = chunk["energy(kWh/hh)"].astype("float64") # Convert energy data to float
-            chunk["cumulative_sum"] = chunk.groupby('date')["energy"].cumsum() # Calculate cumulative energy consumption per day
-            
-            filtered_chunks.append(chunk) # Append the processed chunk to the list
+            filtered_chunks.append(pd.DataFrame({
+                'energy': energy[valid],
+                'household': pd.Categorical(chunk["LCLid"].to_numpy()[in_range][valid], categories=households),
+            }, index=pd.DatetimeIndex(datetime_index.to_numpy()[in_range][valid], name='datetime')))
         else:
             logging.debug(f"No data found in chunk {total_chunks} for household {household} and date range {start_date} to {end_date_obj}")
 
@@ -64,8 +61,8 @@ def load_data(file_path, household, start_date, timescale, chunk_size=10000):
     if chunks_with_data > 0: # Check if any data was loaded
         logging.info(f"Data found in {chunks_with_data} out of {total_chunks} chunks for household {household}")
         df = pd.concat(filtered_chunks) # Concatenate the filtered chunks
-        df.set_index("datetime", inplace=True) # Set the datetime column as the index
-        logging.info(f"Data loaded in {time.time() - start_time:.2f} seconds. Total rows: {len(df)}")
+        logging.info(f"Data loaded in {time.time() - start_time:.2f} seconds. Total rows: {len(df)}, "
+                     f"memory: {df.memory_usage(deep=True).sum() / 1024:.1f} KiB")
         return df # Return the processed DataFrame
     else:
         logging.error(f"No data loaded for household {household} and date range {start_date} to {end_date_obj}")
@@ -86,12 +83,66 @@ def calculate_end_date(start_date, timescale):
         raise ValueError("Invalid timescale. Use 'd' for day, 'w' for week, 'm' for month, or 'y' for year.")
     return end_date_obj.strftime("%Y-%m-%d %H:%M:%S") # Return the end date in string format
 
-def simulate_generation(df, mean=0.5, std=0.2): # Function to simulate energy generation
-    np.random.seed(42) # Set random seed for reproducibility
-    df['generation'] = np.random.normal(mean, std, df.shape[0]) # Generate random data for energy generation
-    df['generation'] = df['generation'].clip(lower=0) # Clip negative values to zero
+def simulate_generation(df, weather='normal', panel_kwp=None, seed=42): # Function to simulate energy generation
+    """
+    Simulate solar generation for the loaded data.
+
+    Each household gets panels sized from its own demand, and all households share the
+    weather of the neighbourhood over the distinct reading times.
+
+    Args:
+    df (pandas.DataFrame): Data frame returned by load_data, for one or more households.
+    weather (str): Weather mode, one of solarGeneration.WEATHER_MODES.
+    panel_kwp (float): Panel size in kWp of every household, sized from each household's demand if not given.
+    seed (int): Seed for the random number generator.
+
+    Returns:
+    pandas.DataFrame: Data frame with a 'generation' column in kWh per reading.
+    """
+    households = df['household'].cat.categories
+    if panel_kwp is None:
+        days = max(df.calendar.n_days, 1) # Number of days in the loaded data
+        annual_demand = df.groupby('household', observed=False)['energy'].sum() * 365 / days
+        panel_kwp = size_panels(annual_demand.reindex(households).to_numpy()) # Size the panels from the annualised demand
+    else:
+        panel_kwp = [float(panel_kwp)] * len(households)
+    time_codes, times = pd.factorize(df.index, sort=True) # The households' readings share the reading times
+    steps = pd.DataFrame(index=times)
+    generation = generate_solar(steps.calendar.day_of_year.to_numpy(), steps.calendar.day_seconds.to_numpy(),
+                                panel_kwp, weather=weather, seed=seed) # (times, households)
+    df['generation'] = generation[time_codes, df['household'].cat.codes.to_numpy()]
     return df # Return the updated DataFrame
 
+def load_simulation_data(file_path, household, start_date, timescale, weather='normal', seed=42, use_cache=True):
+    """
+    Load the household data and simulate its generation, reusing a cached result when possible.
+
+    The result only depends on the contents of the CSV file and the arguments, so it is
+    cached on disk keyed by both and repeat runs skip parsing the CSV entirely.
+
+    Args:
+    file_path (str): Path to the CSV file.
+    household (str): Household ID to filter the data.
+    start_date (str): Start date for analysis in 'YYYY-MM-DD' format.
+    timescale (str): Timescale for analysis ('d', 'w', 'm', 'y').
+    weather (str): Weather mode for the generation.
+    seed (int): Seed for the generation.
+    use_cache (bool): Whether to read and write the disk cache.
+
+    Returns:
+    pandas.DataFrame: Processed data frame with a 'generation' column
+    """
+    def build():
+        df = load_data(file_path, household, start_date, timescale)
+        if df.empty:
+            return df
+        return simulate_generation(df, weather=weather, seed=seed)
+
+    if not use_cache:
+        return build()
+    return dataCache.cached_frame(build, file_path, household=household, start_date=start_date,
+                                  timescale=timescale, weather=weather, seed=seed)
+
 def update_plot_same(df, start_date, end_date, interval, queue, ready_event): # Function to update plot with same y-axis
     """
     Update plot with energy demand, generation, and net energy on the same axis.
@@ -104,6 +155,9 @@ def update_plot_same(df, start_date, end_date, interval, queue, ready_event): #
     queue (multiprocessing.Queue): Queue for recieving plot update signals
     ready_event (multiprocessing.Event): Event to signal plot initialisation
     """
+    # Imported here so only the plotting process pays for matplotlib
+    import matplotlib.pyplot as plt # type: ignore
+    import matplotlib.dates as mdates # type: ignore
     df_day = df[start_date:end_date] # Filter data for the specified date range
     df_day = df_day.reset_index() # Reset index
 
@@ -153,6 +207,9 @@ def update_plot_same(df, start_date, end_date, interval, queue, ready_event): #
     plt.show() # Display the plot
 
 def update_plot_separate(df, start_date, end_date, interval, queue, ready_event):
+    # Imported here so only the plotting process pays for matplotlib
+    import matplotlib.pyplot as plt # type: ignore
+    import matplotlib.dates as mdates # type: ignore
     df_day = df[start_date:end_date]
     df_day = df_day.reset_index()
 
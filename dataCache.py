@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import pandas as pd # type: ignore
+
+# Bump when the layout or contents of the prepared data frame change so old entries are not reused
+CACHE_VERSION = 3
+
+CACHE_DIR = os.environ.get('SOLARVILLE_CACHE_DIR', '.solarville_cache') # Directory holding the cached frames
+MAX_CACHE_BYTES = int(os.environ.get('SOLARVILLE_CACHE_MAX_BYTES', 512 * 1024 * 1024)) # Evict least recently used entries above this size
+
+FINGERPRINT_FILE = 'fingerprints.json' # Remembers file hashes so unchanged files are not hashed again
+ENTRY_SUFFIX = '.pkl'
+
+_lock = threading.Lock() # Serialises writes from the server and simulation threads
+
+def file_fingerprint(file_path, cache_dir=CACHE_DIR):
+    """
+    Identify the contents of a file by its size, modification time and hash.
+
+    The hash is only recomputed when the size or modification time change.
+
+    Args:
+    file_path (str): Path to the file.
+    cache_dir (str): Directory holding the cache.
+
+    Returns:
+    dict: Size, modification time and BLAKE2 hash of the file.
+    """
+    stat = os.stat(file_path)
+    path = os.path.realpath(file_path)
+    known = _read_fingerprints(cache_dir)
+    entry = known.get(path)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''): # Hash in 1 MB blocks to keep memory flat
+            digest.update(block)
+    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest.hexdigest()}
+    known[path] = entry
+    _write_atomic(os.path.join(cache_dir, FINGERPRINT_FILE), json.dumps(known).encode())
+    return entry
+
+def cache_key(file_path, cache_dir=CACHE_DIR, **params):
+    """
+    Build a content-addressed key from a file and the arguments used to prepare it.
+
+    Args:
+    file_path (str): Path to the source file.
+    cache_dir (str): Directory holding the cache.
+    **params: Arguments that determine the prepared data, e.g. household and start date.
+
+    Returns:
+    str: Hex key for the cache entry.
+    """
+    fingerprint = file_fingerprint(file_path, cache_dir)
+    payload = json.dumps({'version': CACHE_VERSION, 'file': fingerprint['hash'], 'size': fingerprint['size'], 'params': params},
+                         sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+def get(key, cache_dir=CACHE_DIR):
+    """
+    Return the cached data frame for a key, or None if it is not cached.
+    """
+    path = os.path.join(cache_dir, key + ENTRY_SUFFIX)
+    try:
+        df = pd.read_pickle(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Discarding unreadable cache entry {path}: {e}")
+        _remove(path)
+        return None
+    try:
+        os.utime(path) # Mark the entry as recently used
+    except OSError:
+        pass
+    return df
+
+def put(key, df, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Store a data frame under a key and evict old entries above the size limit.
+    """
+    path = os.path.join(cache_dir, key + ENTRY_SUFFIX)
+    _write_atomic(path, pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+    evict(cache_dir, max_bytes)
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Remove the least recently used entries until the cache fits in max_bytes.
+    """
+    with _lock:
+        entries = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(ENTRY_SUFFIX):
+                stat = os.stat(os.path.join(cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries): # Oldest first
+            if total <= max_bytes:
+                break
+            _remove(os.path.join(cache_dir, name))
+            total -= size
+            logging.info(f"Evicted cache entry {name}")
+
+def cached_frame(build, file_path, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, **params):
+    """
+    Return the frame prepared from file_path with params, building and caching it on a miss.
+
+    Args:
+    build (callable): Called with no arguments to prepare the frame on a cache miss.
+    file_path (str): Path to the source file.
+    cache_dir (str): Directory holding the cache.
+    max_bytes (int): Size limit of the cache.
+    **params: Arguments that determine the prepared data.
+
+    Returns:
+    pandas.DataFrame: The prepared data frame.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        key = cache_key(file_path, cache_dir, **params)
+    except OSError as e:
+        logging.warning(f"Data cache unavailable, loading without it: {e}")
+        return build()
+
+    df = get(key, cache_dir)
+    if df is not None:
+        logging.info(f"Loaded prepared data from cache ({key})")
+        return df
+
+    df = build()
+    if not df.empty: # Don't cache failed loads
+        try:
+            put(key, df, cache_dir, max_bytes)
+        except OSError as e:
+            logging.warning(f"Failed to write cache entry {key}: {e}")
+    return df
+
+def _read_fingerprints(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, FINGERPRINT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_atomic(path, data):
+    # Write to a temporary file first so a crash never leaves a half written entry
+    with _lock:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,22 @@
+import importlib.util
+import sys
+
+def lazy_import(name):
+    """
+    Import a module on first attribute access instead of straight away.
+
+    Keeps heavy dependencies such as requests off the startup path of tools that
+    may never use them. The module is registered in sys.modules, so later plain
+    imports of it share the same, still lazy, module.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
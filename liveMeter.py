@@ -0,0 +1,209 @@
+import asyncio
+import csv
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime
+from trading import bilateral_trade
+from energyMeter import BATTERY_CAPACITY_AH, Calibration, CoulombCounter, EnergyIntegrator
+
+# One raw sensor reading of the solar panel and battery INA219s, bus voltage in V and current in A
+Sample = namedtuple('Sample', ['timestamp', 'solar_voltage', 'solar_current', 'battery_voltage', 'battery_current'])
+# One trading step built from the samples of one sampling interval
+Step = namedtuple('Step', ['timestamp', 'generation', 'demand', 'battery_power', 'balance', 'battery_charge'])
+
+SAMPLE_INTERVAL = 2.0 # Seconds between sensor readings, as in dataLogger.py
+METER_INTERVAL = 1800 # Seconds covered by one smart meter reading
+BUFFER_SIZE = 8 # Maximum number of items waiting between two stages
+END = None # Passed down the pipeline when the source is exhausted
+
+async def ina219_source(interval=SAMPLE_INTERVAL):
+    """
+    Read the solar panel and battery INA219 sensors every interval seconds.
+    """
+    from solarMonitor import ina219_solar, ina219_battery, read_ina219 # Only available on the Pi
+    next_read = time.monotonic()
+    while True:
+        solar_voltage, _, solar_current, _ = read_ina219(ina219_solar)
+        battery_voltage, _, battery_current, _ = read_ina219(ina219_battery)
+        yield Sample(datetime.now(), solar_voltage, solar_current, battery_voltage, battery_current)
+        next_read += interval
+        await asyncio.sleep(max(0.0, next_read - time.monotonic()))
+
+async def replay_source(file_path, speed=1.0):
+    """
+    Replay readings recorded by dataLogger.py, paced by their timestamps.
+
+    Args:
+    file_path (str): CSV file written by dataLogger.py.
+    speed (float): Replay speed, 1.0 for the recorded pace, 0 for as fast as possible.
+    """
+    with open(file_path, newline='') as f:
+        reader = csv.DictReader(f)
+        first_timestamp = None
+        start_time = time.monotonic()
+        for row in reader:
+            timestamp = datetime.strptime(row['Timestamp'], '%Y-%m-%d %H:%M:%S')
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            if speed > 0:
+                due = start_time + (timestamp - first_timestamp).total_seconds() / speed
+                await asyncio.sleep(max(0.0, due - time.monotonic()))
+            else:
+                await asyncio.sleep(0) # Let the other stages run
+            yield Sample(timestamp, float(row['Solar Bus Voltage (V)']), float(row['Solar Current (A)']),
+                         float(row['Battery Bus Voltage (V)']), float(row['Battery Current (A)']))
+
+def time_of_day_demand(readings, interval=METER_INTERVAL):
+    """
+    Demand source that picks the meter reading for the time of day of each live step.
+
+    The first live step is matched to the first day of the readings and later steps
+    move through the days with the clock, wrapping round at the end of the data.
+    Slots without a reading use the mean of that time of day over all days.
+
+    Args:
+    readings (pandas.Series): Average demand in kW indexed by reading time.
+    interval (int): Seconds covered by one reading.
+
+    Returns:
+    callable: Called with a step's datetime, returns the demand in kW.
+    """
+    first_day = readings.index[0].date()
+    table = {}
+    slot_totals = {}
+    for time, demand in zip(readings.index, readings.tolist()):
+        slot = (time.hour * 3600 + time.minute * 60 + time.second) // interval
+        table[((time.date() - first_day).days, slot)] = demand
+        total, count = slot_totals.get(slot, (0.0, 0))
+        slot_totals[slot] = (total + demand, count + 1)
+    slot_means = {slot: total / count for slot, (total, count) in slot_totals.items()}
+    n_days = max(day for day, _ in table) + 1
+    live_start = None
+
+    def demand_at(timestamp):
+        nonlocal live_start
+        if live_start is None:
+            live_start = timestamp.date()
+        day = (timestamp.date() - live_start).days % n_days
+        slot = (timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second) // interval
+        return table.get((day, slot), slot_means.get(slot, 0.0))
+    return demand_at
+
+async def _put_latest(queue, item):
+    # The sensor must never wait for a slow consumer, so drop the oldest step instead
+    if queue.full():
+        queue.get_nowait()
+        logging.warning("Live meter pipeline is behind, dropped the oldest step")
+    await queue.put(item)
+
+async def _sample_stage(source, out_queue, stop, drop_when_full, samples_per_step, scale, solar, battery, state):
+    # Integrate every calibrated reading as it arrives, so a slow consumer can only drop whole steps and the
+    # energy totals and battery charge still cover every interval. A step is the energy (kWh) of samples_per_step readings
+    count = 0
+    previous_seconds = previous_solar = previous_battery = 0.0
+    async for sample in source:
+        if stop is not None and stop.is_set(): # End the stream, the later stages finish the steps in flight
+            logging.info("Live meter mode interrupted.")
+            break
+        timestamp = sample.timestamp.timestamp()
+        solar.add(timestamp, sample.solar_voltage, sample.solar_current)
+        battery.add(timestamp, sample.battery_voltage, sample.battery_current)
+        count += 1
+        if count < samples_per_step:
+            continue
+        count = 0
+        seconds = solar.seconds - previous_seconds # Time covered since the previous step
+        if seconds <= 0: # The first reading only starts the integration
+            continue
+        hours = seconds / 3600
+        generation = (solar.energy_wh - previous_solar) / 1000 * scale
+        battery_energy = battery.energy_wh - previous_battery # Into the battery when positive, in Wh
+        previous_seconds, previous_solar, previous_battery = solar.seconds, solar.energy_wh, battery.energy_wh
+        state['battery_soc'] = battery.counter.soc # Measured charge of the table-top battery
+        step = (sample.timestamp, hours, generation, battery_energy, state['battery_soc'])
+        if drop_when_full:
+            await _put_latest(out_queue, step)
+        else: # A recorded stream waits for the pipeline, so the results don't depend on the machine's speed
+            await out_queue.put(step)
+    await out_queue.put(END)
+
+async def _battery_stage(in_queue, out_queue, demand_source, scale):
+    # The measured battery is the household's battery: what it takes or gives is not traded
+    while (item := await in_queue.get()) is not END:
+        timestamp, hours, generation, battery_energy, battery_charge = item
+        demand = demand_source(timestamp) * hours # Demand of the household over this step
+        balance = generation - demand - battery_energy / 1000 * scale
+        await out_queue.put(Step(timestamp, generation, demand, battery_energy / hours, balance, battery_charge))
+    await out_queue.put(END)
+
+async def _trading_stage(in_queue, out_queue, state):
+    # Trade against the most recent peer state, which the exchange stage keeps up to date
+    while (step := await in_queue.get()) is not END:
+        peer_balance = state['peer_balance']
+        trade_amount, price = ((0.0, 0.0) if peer_balance is None
+                               else bilateral_trade(step.balance, peer_balance, state['peer_price']))
+        state['currency'] += trade_amount * price
+        step = step._replace(balance=step.balance - trade_amount)
+        if trade_amount:
+            logging.info(f"{'Sold' if trade_amount > 0 else 'Bought'} {abs(trade_amount):.4f} kWh at {price:.2f} £/kWh")
+        await out_queue.put((step, trade_amount, price, state['currency']))
+    await out_queue.put(END)
+
+async def _exchange_stage(in_queue, state, peer_exchange, on_step):
+    while (item := await in_queue.get()) is not END:
+        step, trade_amount, price, currency = item
+        if peer_exchange is not None:
+            update_data = {'demand': step.demand, 'generation': step.generation, 'balance': step.balance,
+                           'battery_charge': step.battery_charge}
+            # The HTTP calls block, so run them in a worker thread to keep sampling on time
+            # None when the peer state is too old, then the trading stage trades with the grid only
+            state['peer_balance'], state['peer_price'] = await asyncio.to_thread(peer_exchange, update_data)
+        if on_step is not None:
+            on_step(step, trade_amount, price, currency)
+
+async def run_live_pipeline(source, demand_source, peer_exchange=None, on_step=None,
+                            samples_per_step=1, scale=1.0, buffer_size=BUFFER_SIZE, currency=100.0, calibration=None,
+                            battery_capacity=BATTERY_CAPACITY_AH, stop=None, drop_when_full=False):
+    """
+    Stream sensor readings through integration, the battery, trading and the peer exchange.
+
+    Every stage runs as its own task connected to the next by a bounded queue, so a
+    reading reaches the trading decision within one sampling interval. The readings
+    are calibrated and integrated over their timestamps (see energyMeter) as soon as
+    they are read, and the table-top battery's state of charge is counted from its
+    current, so the totals cover every reading even when a step is dropped. The energy the
+    battery takes or gives, scaled up like the panel's, is left out of the balance
+    traded with the peer.
+
+    Args:
+    source (async iterator): Yields Sample readings, e.g. ina219_source() or replay_source().
+    demand_source (callable): Returns the household's average demand in kW at a step's datetime, e.g. time_of_day_demand().
+    peer_exchange (callable): Sends this household's step to the peer and returns the peer's balance and the price
+    it sets (None for a household), or (None, None) for grid only, e.g. PeerLink.exchange.
+    on_step (callable): Called with each Step, the traded energy, the price and the currency.
+    samples_per_step (int): Number of readings integrated into one trading step.
+    scale (float): Factor from the table-top panel and battery to household scale.
+    buffer_size (int): Capacity of the queues between stages.
+    currency (float): Starting currency of the household.
+    calibration (dict): Calibration of the 'solar' and 'battery' sensors, e.g. from energyMeter.load_calibration().
+    battery_capacity (float): Capacity of the table-top battery in Ah.
+    stop (threading.Event): Ends the stream when set, e.g. from another thread on Ctrl+C.
+    drop_when_full (bool): Drop the oldest step rather than wait when the pipeline falls behind, for
+    live sensors that can't be paused. A replayed file waits instead.
+
+    Returns:
+    dict: Final state with the currency, the last known peer balance and the measured battery state of charge.
+    """
+    calibration = calibration or {}
+    solar = EnergyIntegrator(calibration.get('solar', Calibration()))
+    battery = EnergyIntegrator(calibration.get('battery', Calibration()), counter=CoulombCounter(battery_capacity))
+    state = {'currency': currency, 'peer_balance': None, 'peer_price': None, 'battery_soc': battery.counter.soc}
+    queues = [asyncio.Queue(maxsize=buffer_size) for _ in range(3)]
+    await asyncio.gather(
+        _sample_stage(source, queues[0], stop, drop_when_full, samples_per_step, scale, solar, battery, state),
+        _battery_stage(queues[0], queues[1], demand_source, scale),
+        _trading_stage(queues[1], queues[2], state),
+        _exchange_stage(queues[2], state, peer_exchange, on_step),
+    )
+    return state
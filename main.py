@@ -1,27 +1,44 @@
 import argparse
+import asyncio
 import time
-import pandas as pd # type: ignore
+import os
 from multiprocessing import Process, Queue, Event
 import threading
 import logging
 import platform
-import requests
 import random
+from datetime import timezone
 import numpy as np
-from flask import request
-from trading import calculate_price
-from dataAnalysis import load_data, calculate_end_date, simulate_generation, update_plot_separate, update_plot_same
-from config import LOCAL_IP, PEER_IP
+from trading import bilateral_trade
+from dataAnalysis import load_simulation_data, calculate_end_date, update_plot_separate, update_plot_same
+from solarGeneration import INTERVAL_SECONDS, WEATHER_MODES
+from batteryOptimiser import BatteryOptimiser
+from pricing import P_MAX, linear_price
+from liveMeter import ina219_source, replay_source, run_live_pipeline, time_of_day_demand
+from energyMeter import BATTERY_CAPACITY_AH, CALIBRATION_FILE, load_calibration
+from resultsStore import RESULTS_DIR, ResultsStore
+from simulationClock import MODES as CLOCK_MODES, CATCH_UP_POLICIES, SimulationClock
+from peerLink import PeerLink
+from community import MARKETS, Community
+from checkpoint import CheckpointWriter, RECORD_DTYPE, checkpoint_path, load_checkpoint
+from config import discover_ips
+from lazyImport import lazy_import
 
+requests = lazy_import('requests') # Only imported once the first request is made
+
+LOCAL_IP, PEER_IP = None, None # Set by discover_ips() when the simulation starts
 max_battery_charge = 1.0
 min_battery_charge = 0.0
+dispatch_optimiser = None # Look-ahead battery optimiser, set up when --dispatch is lookahead
+peer_link = None # Circuit breaker around the peer exchange, set up when the simulation starts
+stop_event = threading.Event() # Set by the main thread on Ctrl+C, the simulation thread then stops and stores its results
 
 # Conditionally import the correct modules based on the platform
 if platform.system() == 'Darwin':  # MacOS
-    from mock_batteryControl import update_battery_charge, read_battery_charge
+    from mock_batteryControl import update_battery_charge, read_battery_charge, set_battery_charge
     from mock_lcdControlTest import display_message
 else:  # Raspberry Pi
-    from batteryControl import update_battery_charge, read_battery_charge
+    from batteryControl import update_battery_charge, read_battery_charge, set_battery_charge
     from lcdControlTest import display_message
 
 # Configure logging
@@ -29,7 +46,8 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 # This function is the main driver of the simulation
 def start_simulation_local():
-    if not synchronize_start(): # Calls the function to synchronize the start of the simulation
+    resume_step = synchronize_start(len(checkpoint_records)) # Calls the function to synchronize the start of the simulation
+    if resume_step is None:
         logging.error('Failed to start simulation') # Logs an error message if the simulation fails to start
         return
     
@@ -39,69 +57,138 @@ def start_simulation_local():
         logging.error('Failed to start simulation')
         return
     
-    start_time = time.time() # Get the current time
-
-    df = load_data(args.file_path, args.household, args.start_date, args.timescale) # Load the data
-    if df.empty:
-        logging.error("No data loaded. Exiting simulation.") # Logs an error message if the data fails to load
-        return
-    df = simulate_generation(df, mean=0.5, std=0.2) # Simulate the generation data
-    end_date = calculate_end_date(args.start_date, args.timescale) # Calculate the end date of the simulation
-    logging.info(f"Data loaded in {time.time() - start_time:.2f} seconds") # Logs a message with the time taken to load the data
+    # The data was loaded once by initialize_simulation, work on a copy of it
+    df = simulation_data.copy()
+    setup_dispatch(df)
+    setup_peer_link()
+    server.series_pyramid.reset() # Start the dashboard series afresh
     
     queue = Queue() # Create a queue for communication between the main thread and the plotting process
-    ready_event = Event() # Create an event to signal when the plot is ready
-    plot_process = Process(target=plot_data, args=(df, args.start_date, end_date, args.timescale, args.separate, queue, ready_event)) # Create a process for plotting the data
-    plot_process.start() # Start the plotting process
-    
-    # Wait for the plotting process to signal that it is ready
-    ready_event.wait()
-    logging.info("Plot initialized, starting simulation...")
+    plot_process = None
+    if not args.no_plot: # The browser dashboard at /dashboard works without the plotting process
+        ready_event = Event() # Create an event to signal when the plot is ready
+        plot_process = Process(target=plot_data, args=(df, args.start_date, end_date, args.timescale, args.separate, queue, ready_event)) # Create a process for plotting the data
+        plot_process.start() # Start the plotting process
+        
+        # Wait for the plotting process to signal that it is ready
+        ready_event.wait()
+        logging.info("Plot initialized, starting simulation...")
 
-    df['balance'] = df['generation'] - df['energy']  # Calculate the balance for each row
+    df['balance'] = (df['generation'] - df['energy']).astype(np.float64)  # Calculate the balance for each row, in float64 as trading writes full precision values
     df['currency'] = 100.0  # Initialize the currency column to 100
     df['battery_charge'] = 0.5  # Assume 50% initial charge
     logging.info("Dataframe for balance, currency and battery charge is created.")
+
+    if resume_step > 0: # Restore the results of the steps already simulated
+        restored = checkpoint_records[:resume_step]
+        for column in ('balance', 'currency', 'battery_charge'):
+            df.iloc[:resume_step, df.columns.get_loc(column)] = restored[column]
+        set_battery_charge(restored['battery_charge'][-1])
+        for record in restored[~restored['skipped']]: # Show the restored steps on the dashboard
+            server.series_pyramid.append(record['timestamp'] // 10**6, (record['demand'], record['generation'], record['balance'], record['battery_charge'], np.nan))
+        logging.info(f"Resuming simulation from step {resume_step} at {df.index[resume_step - 1]}")
+    checkpoint_writer = CheckpointWriter(checkpoint_file, checkpoint_run_info, interval=args.checkpoint_interval, resume_step=resume_step)
+    completed_steps = resume_step # Number of steps with results, stored when the run ends
+    simulated = np.zeros(len(df.index), dtype=bool) # Steps not skipped by the clock, only these are stored
+    simulated[:resume_step] = ~checkpoint_records['skipped'][:resume_step]
+    carried = [df.columns.get_loc('currency'), df.columns.get_loc('battery_charge')]
+
+    # The clock paces the steps, its speed and mode can be changed while running through the /clock endpoint
+    clock = SimulationClock(mode=args.clock, speed=args.speed, catch_up=args.catch_up)
+    server.simulation_clock = clock
+    if stop_event.is_set(): # Interrupted before the clock was published
+        clock.stop()
+    clock.start()
     
     # Main simulation loop
     try:
-        for timestamp in df.index: # Iterate over each timestamp in the index
-            current_time = time.time() # Get the current time
-            elapsed_time = current_time - start_time # Calculate the elapsed time
+        for step in range(resume_step, len(df.index)): # Iterate over each timestamp in the index, skipping the steps restored from the checkpoint
+            timestamp = df.index[step]
             
-            # Calculate the expected elapsed time based on the simulation speed
-            expected_elapsed_time = (timestamp - df.index[0]).total_seconds() * (6 / 3600)  # 6 seconds per hour
-            
-            # If we're ahead of schedule, wait
-            if elapsed_time < expected_elapsed_time:
-                time.sleep(expected_elapsed_time - elapsed_time)
+            # Wait until the step is due, the catch-up policy may skip it when running late
+            if not clock.wait((timestamp - df.index[resume_step]).total_seconds()):
+                logging.warning(f"Skipped step at {timestamp} to catch up")
+                if step > 0: # Nothing happened in the skipped step, the next one carries on from the previous state
+                    df.iloc[step, carried] = df.iloc[step - 1, carried]
+                checkpoint_writer.append(step, timestamp, *df.loc[timestamp, ['energy', 'generation', 'balance', 'battery_charge', 'currency']],
+                                         skipped=True) # Recorded so a resumed run continues after it
+                continue
+            if stop_event.is_set(): # Stopping the clock woke the wait
+                logging.info("Simulation interrupted.")
+                break
             
             current_data = df.loc[timestamp] # Get the current data for the timestamp
             
             if not current_data.empty: # Check if the current data is not empty
                 df = process_trading_and_lcd(df, timestamp, current_data, current_data['battery_charge']) # Process trading and update the LCD display
+                checkpoint_writer.append(step, timestamp, *df.loc[timestamp, ['energy', 'generation', 'balance', 'battery_charge', 'currency']]) # Record the step for resuming
+                completed_steps = step + 1
+                simulated[step] = True
                 
                 # Update the plot by putting the timestamp in the queue to signal the plotting process
-                queue.put(timestamp)
+                if plot_process is not None:
+                    queue.put(timestamp)
 
-    # Handle keyboard interrupt
-    except KeyboardInterrupt:
-        logging.info("Simulation interrupted.")
     finally:
-        queue.put("done") # Signal the plotting process to finish
-        plot_process.join() # Wait for the plotting process to finish
+        clock.stop() # Release anyone waiting on the clock
+        logging.info(f"Simulation clock: {clock.status()}")
+        peer_link.close()
+        logging.info(f"Peer link: {peer_link.status()}") # Includes the number of degraded steps
+        checkpoint_writer.close() # Write the remaining steps to the checkpoint
+        store_results(df.iloc[:completed_steps][simulated[:completed_steps]], resumed_from=resume_step) # Keep the results so runs can be compared
+        if dispatch_optimiser is not None:
+            logging.info(f"Battery plan solve times: {dispatch_optimiser.solve_time_summary()}")
+        if plot_process is not None:
+            queue.put("done") # Signal the plotting process to finish
+            plot_process.join() # Wait for the plotting process to finish
+
+# This function sets up the look-ahead battery dispatch when the --dispatch flag is set to lookahead
+# The loaded demand and generation serve as the forecasts, priced with the linear trading price capped at P_MAX
+def setup_dispatch(df):
+    global dispatch_optimiser, demand_forecast, generation_forecast, price_forecast
+    dispatch_optimiser = None
+    if args.dispatch != 'lookahead':
+        return
+    demand_forecast = df['energy'].to_numpy(dtype=np.float64)
+    generation_forecast = df['generation'].to_numpy(dtype=np.float64)
+    # Without a cap the price runs away at dawn and dusk, when the generation is tiny, and the plan chases those spikes
+    price_forecast = linear_price(generation_forecast, demand_forecast, p_max=P_MAX)
+    dispatch_optimiser = BatteryOptimiser(horizon=args.horizon, time_budget=args.plan_budget)
+    logging.info(f"Look-ahead battery dispatch over {args.horizon} steps with a {args.plan_budget * 1000:.0f} ms budget")
+
+# This function appends the per-step results and the run settings to the results store
+# A checkpointed run records its checkpoint and resume step, so queries count the restored steps only once
+def store_results(df, household=None, resumed_from=None):
+    if df.empty:
+        return
+    metadata = {'household': household or args.household, 'start_date': args.start_date, 'timescale': args.timescale,
+                'weather': args.weather, 'dispatch': args.dispatch, 'local_ip': LOCAL_IP, 'peer_ip': PEER_IP,
+                'degraded_steps': peer_link.degraded_steps if peer_link is not None else 0}
+    if resumed_from is not None:
+        metadata.update(checkpoint=os.path.basename(checkpoint_file), resumed_from=resumed_from)
+    try:
+        ResultsStore(args.results_dir).append_run(df, metadata)
+    except OSError as e:
+        logging.error(f"Failed to store the simulation results: {e}")
 
 # This function synchronizes the start of the simulation between the two Raspberry Pis
-def synchronize_start():
+# It returns the step both Pis resume from (0 for a fresh run), or None if synchronization failed
+def synchronize_start(local_resume_step=0):
     current_time = time.time() # Get the current time
     start_time = current_time + 10  # Start 10 seconds from now
     
     try:
         peers = [LOCAL_IP, PEER_IP]  # List of both IPs
+
+        # Both Pis resume from the last step they have both checkpointed
+        peer_resume_response = requests.get(f'http://{PEER_IP}:5000/resume_step', timeout=5)
+        peer_resume_response.raise_for_status()
+        resume_step = min(local_resume_step, peer_resume_response.json().get('resume_step', 0))
         
         # Set start time on both Pis
-        response = requests.post('http://localhost:5000/sync_start', json={"start_time": start_time, "peers": peers})
-        peer_response = requests.post(f'http://{PEER_IP}:5000/sync_start', json={"start_time": start_time, "peers": peers})
+        sync_data = {"start_time": start_time, "peers": peers, "resume_step": resume_step}
+        response = requests.post('http://localhost:5000/sync_start', json=sync_data)
+        peer_response = requests.post(f'http://{PEER_IP}:5000/sync_start', json=sync_data)
         
         if response.status_code == 200 and peer_response.status_code == 200: # Check if both responses are successful
             logging.info(f"Simulation will start at {time.ctime(start_time)}")
@@ -124,12 +211,12 @@ def synchronize_start():
             requests.post(f'http://{PEER_IP}:5000/start_simulation', json={'start_time': simulation_start_time}) # Make a POST request to start the simulation on the peer Pi
             
             logging.info("Starting simulation now")
-            return True # Return True if the simulation starts successfully
+            return resume_step # Return the agreed resume step if the simulation starts successfully
     except requests.exceptions.RequestException as e:
         logging.error(f"Network error during synchronization: {e}")
     
     logging.error("Failed to start simulation")
-    return False
+    return None
 
 # This function calls the update_plot_separate function if the separate flag is set to True, otherwise it calls the update_plot_same function
 def plot_data(df, start_date, end_date, timescale, separate, queue, ready_event):
@@ -140,52 +227,52 @@ def plot_data(df, start_date, end_date, timescale, separate, queue, ready_event)
 
 # This function processes the trading and updates the LCD display
 def process_trading_and_lcd(df, timestamp, current_data, battery_charge):
-    demand = current_data['energy'] # Get the energy demand for the current timestamp
-    generation = current_data['generation'] # Get the energy generation for the current timestamp
+    demand = float(current_data['energy']) # Get the energy demand for the current timestamp
+    generation = float(current_data['generation']) # Get the energy generation for the current timestamp
     balance = generation - demand # Calculate the energy balance, which is the difference between generation and demand
     df.loc[timestamp, 'demand'] = demand # Update the demand column in the dataframe
     df.loc[timestamp, 'generation'] = generation # Update the generation column in the dataframe
     df.loc[timestamp, 'balance'] = balance # Update the balance column in the dataframe
+    step = df.index.get_loc(timestamp) # Position of the timestamp in the simulation
+    if step > 0:
+        df.loc[timestamp, 'currency'] = df['currency'].iat[step - 1] # Carry the currency over from the previous step
     
-    battery_charge = update_battery_charge(generation, demand) # Calls the function to update the battery charge based on generation and demand
+    if dispatch_optimiser is None:
+        battery_charge = update_battery_charge(generation, demand) # Calls the function to update the battery charge based on generation and demand
+    else:
+        # Plan the battery over the coming steps and only trade what it doesn't take or give
+        previous_charge = df['battery_charge'].iat[step - 1] if step > 0 else battery_charge
+        plan = dispatch_optimiser.plan(previous_charge, demand_forecast[step:], generation_forecast[step:], price_forecast[step:])
+        battery_charge = set_battery_charge(plan.battery_charge)
+        balance -= plan.battery_flow
+        df.loc[timestamp, 'balance'] = balance
+        logging.info(f"Battery plan solved in {plan.solve_time * 1000:.1f} ms with {plan.grid_points} charge levels")
     df.loc[timestamp, 'battery_charge'] = battery_charge # Update the battery charge column in the dataframe
 
-    # Send updates to Flask server
+    # Send updates to the peer and get its balance, within the step's network budget
     update_data = { # Create a dictionary with the update data
         'demand': demand,
         'generation': generation,
         'balance': balance,
         'battery_charge': battery_charge
     }
-    make_api_call(f'http://{PEER_IP}:5000/update_peer_data', update_data) # Make an API call to update the peer data
+    peer_balance, peer_price = peer_link.exchange(update_data) # Last known state if the peer is down, None to trade with the grid only
 
-    # Get peer data for trading
-    peer_data_response = requests.get(f'http://{PEER_IP}:5000/get_peer_data') # Make a GET request to get the peer data
-    if peer_data_response.status_code == 200: # Checks if the response was successful
-        peer_data = peer_data_response.json() # Set the peer data to the JSON response
-        
-        # Get peer balance with error checking
-        peer_balance = peer_data.get(PEER_IP, {}).get('balance')
-        if peer_balance is None:
-            logging.warning(f"No balance data available for peer {PEER_IP}")
-        else:
-            # Perform trading
-            if balance > 0 and peer_balance < 0: # Checks if local energy is in a surplus and peer energy is in a deficit
-                # This household has excess energy to sell
-                trade_amount = min(balance, abs(peer_balance)) # Calculate the trade amount
-                price = calculate_price(balance, abs(peer_balance)) # Sets the price by calling the calculate_price function
-                df.loc[timestamp, 'balance'] -= trade_amount # Update the balance column in the dataframe after the trade is completed
-                df.loc[timestamp, 'currency'] += trade_amount * price # Update the currency column in the dataframe after the trade is completed
-                logging.info(f"Sold {trade_amount:.2f} kWh at {price:.2f} £/kWh") # Logs a message with the amount sold and the price
-            elif balance < 0 and peer_balance > 0: # Checks if local energy is in a deficit and peer energy is in a surplus
-                # This household needs to buy energy
-                trade_amount = min(abs(balance), peer_balance) # Calculate the trade amount
-                price = calculate_price(peer_balance, abs(balance)) # Sets the price by calling the calculate_price function
-                df.loc[timestamp, 'balance'] += trade_amount # Update the balance column in the dataframe after the trade is completed
-                df.loc[timestamp, 'currency'] -= trade_amount * price # Update the currency column in the dataframe after the trade is completed
-                logging.info(f"Bought {trade_amount:.2f} kWh at {price:.2f} £/kWh") # Logs a message with the amount bought and the price
-    else:
-        logging.error("Failed to get peer data for trading")
+    step_price = np.nan # Price of this step's trade, if any
+    if peer_balance is not None:
+        # Perform trading
+        trade_amount, price = bilateral_trade(balance, peer_balance, peer_price) # Positive when selling, negative when buying
+        if trade_amount:
+            step_price = price
+        df.loc[timestamp, 'balance'] -= trade_amount # Update the balance column in the dataframe after the trade is completed
+        df.loc[timestamp, 'currency'] += trade_amount * price # Update the currency column in the dataframe after the trade is completed
+        if trade_amount > 0:
+            logging.info(f"Sold {trade_amount:.2f} kWh at {price:.2f} £/kWh") # Logs a message with the amount sold and the price
+        elif trade_amount < 0:
+            logging.info(f"Bought {-trade_amount:.2f} kWh at {price:.2f} £/kWh") # Logs a message with the amount bought and the price
+
+    # Add the step to the dashboard series, the price is missing when there was no trade
+    server.series_pyramid.append(timestamp.value // 10**6, (demand, generation, df.loc[timestamp, 'balance'], battery_charge, step_price))
 
     # Update LCD display
     display_message(f"Gen: {generation:.2f}W\nDem: {demand:.2f}W\nBat: {battery_charge * 100:.2f}%")
@@ -201,33 +288,120 @@ def process_trading_and_lcd(df, timestamp, current_data, battery_charge):
 
     return df # Return the updated dataframe
 
-# This function makes API calls with retry logic
-# It is called by the process_trading_and_lcd function to update the peer data
-def make_api_call(url, data, max_retries=3): # Takes the URL, data and max_retries as arguments
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=data, timeout=5)
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException as e:
-            logging.error(f"API call failed (attempt {attempt + 1}/{max_retries}): {e}")
-            if attempt == max_retries - 1:
-                logging.error(f"Max retries reached for {url}")
-    return None
+# This function sets up the circuit breaker around the exchange with the peer
+def setup_peer_link():
+    global peer_link
+    peer_link = PeerLink(PEER_IP, step_budget=args.peer_budget, max_staleness=args.peer_staleness,
+                         failure_threshold=args.peer_failures)
+    return peer_link
+
+# This function runs the live-meter mode, trading on the real panel readings instead of the simulated generation
+# The demand still comes from the household's meter data, one half-hour reading per trading step
+def start_live_simulation():
+    if args.replay_file:
+        source = replay_source(args.replay_file, speed=args.replay_speed) # Replay readings recorded by dataLogger.py
+    else:
+        source = ina219_source() # Read the INA219 sensors on the Pi
+    demand_source = time_of_day_demand((simulation_data['energy'] * 2).astype(float)) # kWh per half hour to average kW
+
+    setup_peer_link()
+    server.series_pyramid.reset() # Start the dashboard series afresh
+
+    def record_step(step, trade_amount, price, currency):
+        # Add the step to the dashboard series, its wall-clock time taken as UTC like the simulated timestamps
+        server.series_pyramid.append(int(step.timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000),
+                                     (step.demand, step.generation, step.balance, step.battery_charge,
+                                      price if trade_amount else np.nan))
+        logging.info(
+            f"At {step.timestamp} - Generation: {step.generation:.4f}kWh, "
+            f"Demand: {step.demand:.4f}kWh, Battery: {step.battery_charge * 100:.2f}%, "
+            f"Balance: {step.balance:.4f}, Currency: {currency:.2f}"
+        )
+
+    try:
+        state = asyncio.run(run_live_pipeline(source, demand_source,
+                                              peer_exchange=peer_link.exchange if PEER_IP else None, on_step=record_step,
+                                              samples_per_step=args.samples_per_step, scale=args.live_scale,
+                                              calibration=load_calibration(args.calibration), battery_capacity=args.battery_capacity,
+                                              stop=stop_event, drop_when_full=not args.replay_file)) # Only the sensors can't wait
+        logging.info(f"Live meter stream ended. Currency: {state['currency']:.2f}, measured battery charge: {state['battery_soc'] * 100:.1f}%")
+    finally:
+        peer_link.close()
+        logging.info(f"Peer link: {peer_link.status()}")
+
+# This function runs a community of virtual households on this Pi, advanced together as NumPy arrays
+# Physical Pis whose peer is this Pi join as live members: they post their balance to /update_peer_data as usual,
+# and read the community's balance from /get_peer_data, where it appears as this Pi's entry
+def start_community_simulation():
+    community = Community.from_meter_data(args.file_path, args.household.split(','), args.start_date, args.timescale,
+                                          n_households=args.community, weather=args.weather, use_cache=not args.no_cache,
+                                          market=args.market)
+    server.series_pyramid.reset()
+    clock = SimulationClock(mode=args.clock, speed=args.speed, catch_up=args.catch_up)
+    server.simulation_clock = clock
+    live_timeout = 2 * INTERVAL_SECONDS / clock.speed if clock.mode in ('realtime', 'scaled') else 10.0 # Seconds before a quiet Pi stops trading
+    if stop_event.is_set(): # Interrupted before the clock was published
+        clock.stop()
+    clock.start()
+
+    try:
+        for step in range(len(community)):
+            if not clock.wait(step * INTERVAL_SECONDS):
+                community.step() # Late steps still advance the households, without the live members
+                continue
+            if stop_event.is_set(): # Stopping the clock woke the wait
+                logging.info("Community simulation interrupted.")
+                break
+            now = time.monotonic()
+            live_balances = {ip: data['balance'] for ip, data in list(server.peer_data.items())
+                             if ip != LOCAL_IP and 'balance' in data and now - server.peer_updated.get(ip, 0.0) < live_timeout}
+            result, live_trades = community.step(live_balances)
+            server.peer_data[LOCAL_IP] = {'demand': result.demand, 'generation': result.generation,
+                                          'balance': community.published_balance, 'battery_charge': result.battery_charge,
+                                          'price': community.published_price}
+            server.series_pyramid.append(result.timestamp.value // 10**6, (result.demand, result.generation, result.balance,
+                                                                            result.battery_charge, result.price))
+            for ip, (amount, price) in live_trades.items():
+                logging.info(f"{'Sold' if amount > 0 else 'Bought'} {abs(amount):.2f} kWh {'to' if amount > 0 else 'from'} {ip} at {price:.2f} £/kWh")
+            logging.info(f"At {result.timestamp} - {community.n_households} households, Generation: {result.generation:.2f}kWh, "
+                         f"Demand: {result.demand:.2f}kWh, Traded: {result.traded:.2f}kWh, Grid: {result.balance:.2f}kWh, "
+                         f"Battery: {result.battery_charge * 100:.2f}%, Live members: {len(live_balances)}")
+    finally:
+        clock.stop()
+        store_results(community.frame(), household=f"community-{community.n_households}")
 
 # This function initializes the simulation by loading the data and simulating the generation
 # It is called by the main function
 def initialize_simulation():
-    global df, end_date # Declare the global variables df and end_date to be used in the start_simulation_local function
+    global simulation_data, end_date # Declare the global variables simulation_data and end_date to be used in the start_simulation_local function
     logging.info("Loading data, please wait...")
     start_time = time.time() # Get the current time
-    df = load_data(args.file_path, args.household, args.start_date, args.timescale) # Load the data
-    if df.empty: # Checks if the dataframe is empty
+    simulation_data = load_simulation_data(args.file_path, args.household, args.start_date, args.timescale,
+                                           weather=args.weather, seed=42, use_cache=not args.no_cache) # Load the data and simulate the generation
+    if simulation_data.empty: # Checks if the dataframe is empty
         logging.error("No data loaded. Exiting simulation.")
-        return
-    df = simulate_generation(df, mean=0.5, std=0.2) # Simulate the generation data
+        return False
     end_date = calculate_end_date(args.start_date, args.timescale) # Calculate the end date of the simulation
     logging.info(f"Data loaded in {time.time() - start_time:.2f} seconds") # Logs a message with the time taken to load the data
+    return True
+
+# This function finds the steps already simulated by a previous run of the same configuration
+# It is called by the main function and only reads the checkpoint when the --resume flag is set
+def load_resume_checkpoint():
+    global checkpoint_file, checkpoint_run_info, checkpoint_records
+    checkpoint_file = checkpoint_path(args.household, args.start_date, args.timescale, args.weather)
+    checkpoint_run_info = {'household': args.household, 'start_date': args.start_date, 'timescale': args.timescale,
+                           'weather': args.weather, 'steps': len(simulation_data)}
+    checkpoint_records = load_checkpoint(checkpoint_file, checkpoint_run_info) if args.resume else np.empty(0, dtype=RECORD_DTYPE)
+
+    # Only trust the checkpointed steps that line up with the loaded data
+    recorded = checkpoint_records['timestamp']
+    mismatched = np.flatnonzero((recorded != simulation_data.index[:len(recorded)].asi8) | (checkpoint_records['step'] != np.arange(len(recorded))))
+    if mismatched.size:
+        checkpoint_records = checkpoint_records[:mismatched[0]]
+    if args.resume:
+        logging.info(f"Found {len(checkpoint_records)} checkpointed steps in {checkpoint_file}")
+    return len(checkpoint_records)
 
 # This block of code is executed when the script is run
 # It parses the command line arguments and calls the initialize_simulation function
@@ -237,20 +411,67 @@ if __name__ == "__main__":
     parser.add_argument('--household', type=str, required=True, help='Household ID for the data')
     parser.add_argument('--start_date', type=str, required=True, help='Start date for the simulation')
     parser.add_argument('--timescale', type=str, required=True, choices=['d', 'w', 'm', 'y'], help='Timescale: d for day, w for week, m for month, y for year')
+    parser.add_argument('--weather', type=str, default='normal', choices=list(WEATHER_MODES), help='Weather mode for the solar generation')
+    parser.add_argument('--no_cache', action='store_true', help='Always reload the CSV instead of using the prepared data cache')
+    parser.add_argument('--resume', action='store_true', help='Continue from the last checkpoint of this run')
+    parser.add_argument('--checkpoint_interval', type=int, default=10, help='Number of steps between checkpoints')
+    parser.add_argument('--dispatch', type=str, default='greedy', choices=['greedy', 'lookahead'], help='Battery dispatch: greedy, or planned over a rolling horizon')
+    parser.add_argument('--horizon', type=int, default=48, help='Number of steps the look-ahead dispatch plans ahead')
+    parser.add_argument('--plan_budget', type=float, default=0.05, help='Seconds allowed for each look-ahead re-plan')
+    parser.add_argument('--results_dir', type=str, default=RESULTS_DIR, help='Directory of the results store')
+    parser.add_argument('--live', action='store_true', help='Trade on the live INA219 panel readings instead of the simulated generation')
+    parser.add_argument('--replay_file', type=str, help='Replay a CSV recorded by dataLogger.py instead of reading the sensors (live mode)')
+    parser.add_argument('--replay_speed', type=float, default=1.0, help='Replay speed factor, 0 for as fast as possible (live mode)')
+    parser.add_argument('--samples_per_step', type=int, default=1, help='Number of sensor readings integrated into each trading step (live mode)')
+    parser.add_argument('--live_scale', type=float, default=1000.0, help='Factor from the table-top panel to household scale (live mode)')
+    parser.add_argument('--calibration', type=str, default=CALIBRATION_FILE, help='JSON file with the offset and gain of each INA219 (live mode)')
+    parser.add_argument('--battery_capacity', type=float, default=BATTERY_CAPACITY_AH, help='Capacity of the table-top battery in Ah for its measured state of charge (live mode)')
+    parser.add_argument('--clock', type=str, default='scaled', choices=CLOCK_MODES, help='Simulation pacing: realtime, scaled by --speed, fast as possible, or stepped through the /clock endpoint')
+    parser.add_argument('--speed', type=float, default=600.0, help='Simulated seconds per second for the scaled clock (600 = 6 seconds per simulated hour)')
+    parser.add_argument('--catch_up', type=str, default='slip', choices=CATCH_UP_POLICIES, help='What to do when steps run late: slip the schedule, batch late steps or skip them')
+    parser.add_argument('--peer_budget', type=float, default=1.0, help='Seconds of network time allowed per step for the peer exchange')
+    parser.add_argument('--peer_staleness', type=int, default=4, help='Steps the last known peer state may be traded on while the peer is unreachable')
+    parser.add_argument('--peer_failures', type=int, default=3, help='Failed peer exchanges in a row before the circuit opens')
+    parser.add_argument('--community', type=int, help='Run a community of this many virtual households on this Pi, built from the comma-separated --household IDs')
+    parser.add_argument('--market', type=str, default='pool', choices=MARKETS, help='Community trading: one pool price, or the order book with battery-based limit prices')
+    parser.add_argument('--no_plot', action='store_true', help='Skip the matplotlib window, the dashboard is served at http://<pi>:5000/dashboard')
     parser.add_argument('--separate', action='store_true', help='Flag to plot data in separate subplots')
 
     args = parser.parse_args()  # Parse the arguments
-    initialize_simulation() # Initialize the simulation
+    LOCAL_IP, PEER_IP = discover_ips() # Find this Pi and its peer on the network
+    logging.info(f"Local IP: {LOCAL_IP}, Peer IP: {PEER_IP}")
+    if not args.community and not initialize_simulation(): # Initialize the simulation, the community loads its own data
+        raise SystemExit(1)
 
-    from server import app # Import the Flask app
+    import server # Import the Flask server
+    if not args.community: # The community doesn't checkpoint
+        server.local_resume_step = load_resume_checkpoint() # Tell the peer how far this Pi got
+    app = server.app
     # Start the server and simulation in separate threads to run concurrently
     server_thread = threading.Thread(target=app.run, kwargs={'host': '0.0.0.0', 'port': 5000})
+    server_thread.daemon = True # Don't keep the process alive if the simulation fails
     server_thread.start() # Start the server thread
     
-    time.sleep(2)  # Give the server a moment to start
+    if not server.wait_for_server('http://localhost:5000/health'): # Wait until the server answers instead of sleeping a fixed time
+        logging.error("Server did not start. Exiting simulation.")
+        raise SystemExit(1)
     
-    simulation_thread = threading.Thread(target=start_simulation_local) # Create a thread for the simulation
+    if args.community:
+        target = start_community_simulation
+    elif args.live:
+        target = start_live_simulation
+    else:
+        target = start_simulation_local
+    simulation_thread = threading.Thread(target=target) # Create a thread for the simulation
     simulation_thread.start() # Start the simulation thread
     
-    simulation_thread.join() # Wait for the simulation thread to finish
-    server_thread.join() # Wait for the server thread to finish
\ No newline at end of file
+    try:
+        simulation_thread.join() # Wait for the simulation thread to finish
+        server_thread.join() # Wait for the server thread to finish
+    except KeyboardInterrupt:
+        # Ctrl+C is raised in this thread, so ask the simulation thread to stop and store what it has done
+        logging.info("Stopping the simulation...")
+        stop_event.set()
+        if server.simulation_clock is not None:
+            server.simulation_clock.stop() # Wake a step waiting on the clock
+        simulation_thread.join()
\ No newline at end of file
@@ -0,0 +1,177 @@
+import heapq
+import numpy as np
+
+P_MIN = 0.10 # Lowest price a household will trade at (£/kWh), as in tradingSDR.py
+P_MAX = 1.0 # Highest price a household will trade at (£/kWh)
+
+EPSILON = 1e-12 # Quantities below this are treated as fully filled
+
+# Trades are returned as a structured array with one row per fill
+TRADE_DTYPE = np.dtype([
+    ('timestamp', 'i8'), # Step the trade happened in
+    ('buyer', 'i4'), # Household index of the buyer
+    ('seller', 'i4'), # Household index of the seller
+    ('quantity', 'f8'), # Energy traded in kWh
+    ('price', 'f8'), # Price in £/kWh
+])
+
+def limit_prices(battery_charge, p_min=P_MIN, p_max=P_MAX):
+    """
+    Derive each household's limit price from its battery state of charge.
+
+    A household with a full battery has nowhere to store a surplus, so it sells
+    cheaply and only buys cheaply. With an empty battery it holds out for a high price
+    when selling and will pay a high price when buying.
+
+    Args:
+    battery_charge (numpy.ndarray): State of charge of each household, 0 to 1.
+    p_min (float): Lowest limit price.
+    p_max (float): Highest limit price.
+
+    Returns:
+    numpy.ndarray: Limit price of each household in £/kWh.
+    """
+    soc = np.clip(np.asarray(battery_charge, dtype=np.float64), 0.0, 1.0)
+    return p_min + (p_max - p_min) * (1.0 - soc)
+
+class OrderBook:
+    """
+    Continuous double auction with price-time priority.
+
+    Bids and asks rest in two heaps, so the best order on each side is found in
+    O(1) and inserted or removed in O(log n). An incoming order trades against the
+    best resting orders on the other side while their prices cross, at the resting
+    order's price, and any remainder rests in the book.
+    """
+
+    def __init__(self):
+        self.bids = [] # Entries are [-price, sequence, household, quantity]
+        self.asks = [] # Entries are [price, sequence, household, quantity]
+        self._sequence = 0 # Arrival order, breaks ties between equal prices
+        self._trades = ([], [], [], [], []) # Columns of TRADE_DTYPE, filled as orders match
+
+    def submit(self, household, quantity, limit_price, timestamp=0):
+        """
+        Submit an order, selling if quantity is positive and buying if it is negative.
+        """
+        if quantity > EPSILON:
+            self._sell(household, quantity, limit_price, timestamp)
+        elif quantity < -EPSILON:
+            self._buy(household, -quantity, limit_price, timestamp)
+
+    def _sell(self, household, quantity, limit_price, timestamp):
+        bids = self.bids
+        timestamps, buyers, sellers, quantities, prices = self._trades
+        while bids and -bids[0][0] >= limit_price:
+            best = bids[0]
+            fill = quantity if quantity < best[3] else best[3]
+            timestamps.append(timestamp)
+            buyers.append(best[2])
+            sellers.append(household)
+            quantities.append(fill)
+            prices.append(-best[0])
+            best[3] -= fill
+            quantity -= fill
+            if best[3] <= EPSILON:
+                heapq.heappop(bids)
+            if quantity <= EPSILON:
+                return
+        self._sequence += 1
+        heapq.heappush(self.asks, [limit_price, self._sequence, household, quantity])
+
+    def _buy(self, household, quantity, limit_price, timestamp):
+        asks = self.asks
+        timestamps, buyers, sellers, quantities, prices = self._trades
+        while asks and asks[0][0] <= limit_price:
+            best = asks[0]
+            fill = quantity if quantity < best[3] else best[3]
+            timestamps.append(timestamp)
+            buyers.append(household)
+            sellers.append(best[2])
+            quantities.append(fill)
+            prices.append(best[0])
+            best[3] -= fill
+            quantity -= fill
+            if best[3] <= EPSILON:
+                heapq.heappop(asks)
+            if quantity <= EPSILON:
+                return
+        self._sequence += 1
+        heapq.heappush(self.bids, [-limit_price, self._sequence, household, quantity])
+
+    def best_bid(self):
+        return -self.bids[0][0] if self.bids else None
+
+    def best_ask(self):
+        return self.asks[0][0] if self.asks else None
+
+    def clear(self):
+        # Cancel all resting orders, e.g. at the end of a step since energy can't wait for a later one
+        self.bids.clear()
+        self.asks.clear()
+
+    def take_trades(self):
+        """
+        Return the trades since the last call as a TRADE_DTYPE array.
+        """
+        trades = np.empty(len(self._trades[0]), dtype=TRADE_DTYPE)
+        for name, column in zip(TRADE_DTYPE.names, self._trades):
+            trades[name] = column
+            column.clear()
+        return trades
+
+def clear_timestep(quantities, prices, timestamp=0, order=None, book=None):
+    """
+    Run one step of the market for many households and return the trades.
+
+    Orders arrive in the given order (array order by default), which sets their time
+    priority. Orders left unmatched at the end of the step are cancelled.
+
+    Args:
+    quantities (numpy.ndarray): Energy each household offers, positive to sell and negative to buy.
+    prices (numpy.ndarray): Limit price of each household, e.g. from limit_prices().
+    timestamp (int): Step recorded with the trades.
+    order (numpy.ndarray): Arrival order of the households, e.g. a random permutation.
+    book (OrderBook): Book to trade in, a new one if not given.
+
+    Returns:
+    numpy.ndarray: TRADE_DTYPE array of the trades.
+    """
+    book = book if book is not None else OrderBook()
+    households = np.arange(len(quantities)) if order is None else np.asarray(order)
+    submit = book.submit
+    for household, quantity, price in zip(households.tolist(), np.asarray(quantities, dtype=np.float64)[households].tolist(),
+                                          np.asarray(prices, dtype=np.float64)[households].tolist()):
+        submit(household, quantity, price, timestamp)
+    book.clear()
+    return book.take_trades()
+
+def settle(trades, n_households):
+    """
+    Net energy bought and money paid by each household over a set of trades.
+
+    Returns:
+    tuple: Energy bought (negative if sold) and currency change of each household.
+    """
+    value = trades['quantity'] * trades['price']
+    energy = np.bincount(trades['buyer'], trades['quantity'], n_households) - np.bincount(trades['seller'], trades['quantity'], n_households)
+    currency = np.bincount(trades['seller'], value, n_households) - np.bincount(trades['buyer'], value, n_households)
+    return energy, currency
+
+if __name__ == "__main__": # Benchmark the market with a neighbourhood of households
+    import time
+
+    rng = np.random.default_rng(42)
+    n_households = 1000
+    n_steps = 200
+    book = OrderBook()
+    n_trades = 0
+    start_time = time.perf_counter()
+    for step in range(n_steps):
+        balance = rng.normal(0.0, 0.5, n_households) # Surplus or deficit of each household
+        prices = limit_prices(rng.uniform(0.0, 1.0, n_households))
+        trades = clear_timestep(balance, prices, timestamp=step, order=rng.permutation(n_households), book=book)
+        n_trades += len(trades)
+    elapsed = time.perf_counter() - start_time
+    n_orders = n_households * n_steps
+    print(f"{n_orders} orders in {elapsed:.2f} s: {n_orders / elapsed:,.0f} orders/s, {n_trades} trades")
@@ -1,6 +1,15 @@
 # mock_batteryControl.py
+battery_charge = 0.5
+
+def set_battery_charge(charge):
+    # Mock restore logic
+    global battery_charge
+    battery_charge = min(1.0, max(0.0, charge))
+    return battery_charge
+
 def update_battery_charge(power_generated, power_demand):
     # Mock update logic
+    global battery_charge
     battery_charge = min(1.0, max(0.0, (power_generated - power_demand) / 100.0))
     print(f"Mock updated battery charge: {battery_charge * 100:.2f}%")
     return battery_charge
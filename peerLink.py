@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from lazyImport import lazy_import
+
+requests = lazy_import('requests') # Only imported once the first request is made
+
+STEP_BUDGET = 1.0 # Seconds of network time allowed per step
+MAX_STALENESS = 4 # Steps the last known peer state may be used for before falling back to the grid
+FAILURE_THRESHOLD = 3 # Consecutive failed exchanges that open the circuit
+PROBE_INTERVAL = 1.0 # Seconds between recovery probes, doubled after each failed probe
+MAX_PROBE_INTERVAL = 30.0
+PROBE_TIMEOUT = 2.0
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+class PeerLink:
+    """
+    Exchanges each step's data with one peer without letting a slow or dead peer stall the simulation.
+
+    Every exchange runs in a worker thread and the step waits for it for at most
+    step_budget seconds in total, however the time is split between connecting and
+    reading. An exchange still running when the next step starts counts as failed. After
+    failure_threshold failed exchanges in a row the circuit opens: steps stop calling
+    the peer and a background thread probes its /health endpoint with a growing
+    interval. Once the peer answers, the next step tries a full exchange again
+    (half-open) and closes the circuit if it succeeds.
+
+    A peer that sets the price, such as a community of virtual households, publishes it
+    with its balance and the step trades at that price.
+
+    When the exchange fails or the circuit is open, the step trades against the last
+    peer state received, as long as it is at most max_staleness steps old, and
+    otherwise trades with the grid only. Steps that did not get a fresh peer state
+    are counted as degraded. Changes of the circuit state are logged, the fallback
+    of each degraded step only at DEBUG level.
+    """
+
+    def __init__(self, peer_ip, port=5000, step_budget=STEP_BUDGET, max_staleness=MAX_STALENESS,
+                 failure_threshold=FAILURE_THRESHOLD, probe_interval=PROBE_INTERVAL):
+        self.peer_ip = peer_ip
+        self.base_url = f'http://{peer_ip}:{port}'
+        self.step_budget = step_budget
+        self.max_staleness = max_staleness
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.failures = 0 # Consecutive failed exchanges
+        self.steps = 0
+        self.degraded_steps = 0 # Steps without a fresh peer state
+        self.stale_steps = 0 # Degraded steps that traded on the last known peer state
+        self.grid_only_steps = 0 # Degraded steps that traded with the grid only
+        self._last_balance = None
+        self._last_price = None
+        self._last_step = None # Step the last peer balance was received in
+        self._lock = threading.Lock() # The probe thread changes the state
+        self._probe_thread = None
+        self._stopped = threading.Event()
+        self._session = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='peer-link') # Runs one exchange at a time
+        self._in_flight = None # Future of the last exchange
+
+    def exchange(self, update_data):
+        """
+        Send this household's step to the peer and return the peer balance to trade against.
+
+        Args:
+        update_data (dict): Demand, generation, balance and battery charge of this step.
+
+        Returns:
+        tuple: Peer balance, fresh or at most max_staleness steps old, and the price the peer
+        trades at, None unless the peer sets it. (None, None) to trade with the grid only.
+        """
+        step = self.steps
+        self.steps += 1
+        with self._lock:
+            attempt = self.state != OPEN
+        balance, price = self._fetch(update_data) if attempt else (None, None)
+        if balance is not None:
+            self._last_balance, self._last_price, self._last_step = balance, price, step
+            return balance, price
+
+        self.degraded_steps += 1
+        if self._last_step is not None and step - self._last_step <= self.max_staleness:
+            self.stale_steps += 1
+            logging.debug(f"Peer {self.peer_ip} unavailable, trading on its state from {step - self._last_step} steps ago")
+            return self._last_balance, self._last_price
+        self.grid_only_steps += 1
+        logging.debug(f"Peer {self.peer_ip} unavailable, trading with the grid only")
+        return None, None
+
+    def _fetch(self, update_data):
+        # Post the update and read the peer's balance and price within the step budget, None if either fails
+        if self._in_flight is not None and not self._in_flight.done():
+            self._record_failure("the previous exchange is still running")
+            return None, None
+        deadline = time.monotonic() + self.step_budget
+        self._in_flight = self._executor.submit(self._request, update_data, deadline)
+        try:
+            peer_state = self._in_flight.result(timeout=self.step_budget) # requests' timeouts apply per read, this is the total
+        except FutureTimeout:
+            self._record_failure(f"no answer within the {self.step_budget:.2f} s step budget")
+            return None, None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._record_failure(e)
+            return None, None
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info(f"Peer {self.peer_ip} recovered, circuit closed")
+            self.state = CLOSED
+            self.failures = 0
+        balance = peer_state.get('balance')
+        if balance is None:
+            logging.debug(f"No balance data available for peer {self.peer_ip}")
+        return balance, peer_state.get('price')
+
+    def _request(self, update_data, deadline):
+        # Runs in the worker thread, which is the only user of the session
+        if self._session is None:
+            self._session = requests.Session() # Keep the connection open between steps
+        response = self._session.post(f'{self.base_url}/update_peer_data', json=update_data, timeout=self.step_budget)
+        response.raise_for_status()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout("Step network budget spent")
+        response = self._session.get(f'{self.base_url}/get_peer_data', timeout=remaining)
+        response.raise_for_status()
+        return response.json().get(self.peer_ip, {})
+
+    def _record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            logging.debug(f"Peer exchange with {self.peer_ip} failed ({self.failures} in a row): {error}")
+            if self.state == CLOSED and self.failures < self.failure_threshold:
+                return
+            if self.state != OPEN:
+                logging.warning(f"Circuit to peer {self.peer_ip} opened after {self.failures} failed exchanges, last error: {error}")
+            self.state = OPEN
+            if self._probe_thread is None or not self._probe_thread.is_alive():
+                logging.info(f"Probing peer {self.peer_ip} for recovery in the background")
+                self._probe_thread = threading.Thread(target=self._probe, daemon=True)
+                self._probe_thread.start()
+
+    def _probe(self):
+        # Poll the peer's readiness probe until it answers, then let the next step try a full exchange
+        interval = self.probe_interval
+        while not self._stopped.wait(interval):
+            try:
+                requests.get(f'{self.base_url}/health', timeout=PROBE_TIMEOUT).raise_for_status()
+            except requests.exceptions.RequestException:
+                interval = min(interval * 2, MAX_PROBE_INTERVAL)
+                continue
+            with self._lock:
+                self.state = HALF_OPEN
+            logging.info(f"Peer {self.peer_ip} answers again, retrying the exchange")
+            return
+
+    def close(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._session is not None:
+            self._session.close()
+
+    def status(self):
+        with self._lock:
+            return {'peer': self.peer_ip, 'state': self.state, 'failures': self.failures, 'steps': self.steps,
+                    'degraded_steps': self.degraded_steps, 'stale_steps': self.stale_steps,
+                    'grid_only_steps': self.grid_only_steps}
@@ -0,0 +1,91 @@
+import numpy as np
+
+BASE_PRICE = 0.10 # Base price per kWh in pounds, as in trading.py
+MIN_PRICE = 0.01 # The linear price is never below this
+
+P_MIN = 0.10 # Lowest SDR price per kWh in pounds, as in tradingSDR.py
+P_MAX = 1.0 # Highest SDR price per kWh in pounds
+
+def linear_price(supply, demand, base_price=BASE_PRICE, p_min=MIN_PRICE, p_max=None):
+    """
+    Price proportional to the demand/supply ratio, for any number of timesteps at once.
+
+    Vectorised form of trading.calculate_price. Supply and demand can be scalars or
+    arrays of any matching shape, e.g. (timesteps,) or (households, timesteps).
+
+    Args:
+    supply (numpy.ndarray): Energy offered in kWh.
+    demand (numpy.ndarray): Energy wanted in kWh.
+    base_price (float): Price when supply equals demand, or when either is zero.
+    p_min (float): Lowest price.
+    p_max (float): Highest price, unbounded if None.
+
+    Returns:
+    numpy.ndarray: Price per kWh in pounds.
+    """
+    supply = np.asarray(supply, dtype=np.float64)
+    demand = np.asarray(demand, dtype=np.float64)
+    trading = (supply > 0) & (demand > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price = np.where(trading, base_price * demand / supply, base_price)
+    return np.clip(price, p_min, p_max)
+
+def sdr_price(supply, demand, p_min=P_MIN, p_max=P_MAX):
+    """
+    Supply/demand-ratio (SDR) price, for any number of timesteps at once.
+
+    The price starts from the midpoint of p_min and p_max and falls as the supply
+    outgrows the demand, clamped to [p_min, p_max]. Without supply or demand there
+    is no trading and the midpoint price applies.
+
+    Args:
+    supply (numpy.ndarray): Energy offered in kWh.
+    demand (numpy.ndarray): Energy wanted in kWh.
+    p_min (float): Lowest price.
+    p_max (float): Highest price.
+
+    Returns:
+    numpy.ndarray: Price per kWh in pounds.
+    """
+    supply = np.asarray(supply, dtype=np.float64)
+    demand = np.asarray(demand, dtype=np.float64)
+    base_price = (p_min + p_max) / 2
+    trading = (supply > 0) & (demand > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price = np.where(trading, base_price * demand / supply, base_price) # base_price * (1 / SDR)
+    return np.clip(price, p_min, p_max)
+
+def supply_and_demand(balance, axis=0):
+    """
+    Total supply and demand from the households' balances.
+
+    Args:
+    balance (numpy.ndarray): Generation minus demand, e.g. shape (households, timesteps).
+    axis (int): Axis of the households.
+
+    Returns:
+    tuple: Supply and demand in kWh, with the household axis summed out.
+    """
+    balance = np.asarray(balance, dtype=np.float64)
+    supply = np.where(balance > 0, balance, 0.0).sum(axis=axis)
+    demand = np.where(balance < 0, -balance, 0.0).sum(axis=axis)
+    return supply, demand
+
+if __name__ == "__main__": # Benchmark day-ahead price curves for a parameter sweep
+    import time
+
+    rng = np.random.default_rng(42)
+    balance = rng.normal(0.0, 0.5, (100, 48)) # 100 households over a day
+    start_time = time.perf_counter()
+    supply, demand = supply_and_demand(balance)
+    linear = linear_price(supply, demand)
+    sdr = sdr_price(supply, demand)
+    elapsed = time.perf_counter() - start_time
+    print(f"Day-ahead curves for 100 households in {elapsed * 1e6:.0f} µs")
+
+    supply = rng.uniform(0.0, 10.0, 1_000_000)
+    demand = rng.uniform(0.0, 10.0, 1_000_000)
+    start_time = time.perf_counter()
+    sdr_price(supply, demand)
+    elapsed = time.perf_counter() - start_time
+    print(f"1,000,000 SDR prices in {elapsed * 1000:.1f} ms")
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import numpy as np
+import pandas as pd # type: ignore
+
+RESULTS_DIR = os.environ.get('SOLARVILLE_RESULTS_DIR', 'results') # Root of the results store
+
+# Per-step result columns stored for every run
+COLUMNS = ['energy', 'generation', 'balance', 'currency', 'battery_charge']
+NS_PER_DAY = 86400 * 10**9
+
+class ResultsStore:
+    """
+    Columnar store of simulation results, one directory per run.
+
+    Runs are partitioned by household (results/household=<id>/run=<run_id>/) and each
+    column is a separate .npy file next to a meta.json holding the run metadata and
+    per-column statistics. Queries only open the columns they need, memory-mapped,
+    and skip whole runs using the metadata and statistics before reading any rows.
+
+    A run resumed from a checkpoint stores the steps it restored again. Runs with the
+    same 'checkpoint' in their metadata and a non-zero 'resumed_from' continue the run
+    before them, and queries count each step only in the latest run of such a chain.
+    """
+
+    def __init__(self, root=RESULTS_DIR):
+        self.root = root
+
+    def append_run(self, df, metadata):
+        """
+        Store the per-step results of a run.
+
+        Args:
+        df (pandas.DataFrame): Simulation frame indexed by time with the COLUMNS to store.
+        metadata (dict): Description of the run, e.g. household, start date and weather.
+
+        Returns:
+        str: ID of the stored run.
+        """
+        run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        household = metadata.get('household', 'unknown')
+        partition = os.path.join(self.root, f"household={household}")
+        os.makedirs(partition, exist_ok=True)
+
+        timestamps = df.index.asi8
+        meta = dict(metadata, run_id=run_id, household=household, rows=len(df),
+                    start=int(timestamps.min()) if len(df) else None, end=int(timestamps.max()) if len(df) else None,
+                    stats={})
+
+        # Write the run to a temporary directory and move it into place, so readers never see half a run
+        tmp_dir = tempfile.mkdtemp(dir=partition, prefix='.tmp-')
+        try:
+            np.save(os.path.join(tmp_dir, 'timestamp.npy'), timestamps)
+            for column in COLUMNS:
+                if column not in df:
+                    continue
+                values = df[column].to_numpy(dtype=np.float64)
+                np.save(os.path.join(tmp_dir, f"{column}.npy"), values)
+                if len(values):
+                    meta['stats'][column] = {'min': float(np.nanmin(values)), 'max': float(np.nanmax(values)),
+                                             'sum': float(np.nansum(values))}
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f, default=str)
+            os.replace(tmp_dir, os.path.join(partition, f"run={run_id}"))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logging.info(f"Stored {len(df)} steps of run {run_id} in {partition}")
+        return run_id
+
+    def runs(self, households=None, start=None, end=None, **filters):
+        """
+        Return the metadata of the runs matching the filters, without reading any rows.
+
+        Args:
+        households (list): Only runs of these households.
+        start (str or pandas.Timestamp): Only runs with steps at or after this time.
+        end (str or pandas.Timestamp): Only runs with steps before this time.
+        **filters: Metadata values to match exactly, e.g. weather='stormy'.
+
+        Returns:
+        list: Run metadata dicts.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        start_ns = pd.Timestamp(start).value if start is not None else None
+        end_ns = pd.Timestamp(end).value if end is not None else None
+        selected = []
+        for partition in sorted(os.listdir(self.root)):
+            if not partition.startswith('household='):
+                continue
+            if households is not None and partition[len('household='):] not in households: # Partition pruning
+                continue
+            metas = []
+            for run in sorted(os.listdir(os.path.join(self.root, partition))):
+                if not run.startswith('run='):
+                    continue
+                path = os.path.join(self.root, partition, run)
+                with open(os.path.join(path, 'meta.json')) as f:
+                    meta = json.load(f)
+                meta['path'] = path
+                metas.append(meta)
+            _mark_superseded(metas) # Before filtering, a later run hides steps whatever its other metadata
+            for meta in metas:
+                if meta['rows'] == 0:
+                    continue
+                if start_ns is not None and meta['end'] < start_ns:
+                    continue
+                if end_ns is not None and meta['start'] >= end_ns:
+                    continue
+                if any(meta.get(key) != value for key, value in filters.items()):
+                    continue
+                selected.append(meta)
+        return selected
+
+    def scan(self, columns, households=None, start=None, end=None, **filters):
+        """
+        Yield the requested columns of each matching run, trimmed to the time range.
+
+        Only the requested columns are opened, memory-mapped, and the time range is
+        cut with a binary search on the sorted timestamps. Steps stored again by a
+        later resumed run are left out.
+
+        Yields:
+        tuple: Run metadata and a dict of column name to array, including 'timestamp'.
+        """
+        for meta in self.runs(households, start, end, **filters):
+            timestamps = np.load(os.path.join(meta['path'], 'timestamp.npy'), mmap_mode='r')
+            lo = np.searchsorted(timestamps, pd.Timestamp(start).value) if start is not None else 0
+            hi = np.searchsorted(timestamps, pd.Timestamp(end).value) if end is not None else len(timestamps)
+            rows = slice(lo, hi)
+            if meta.get('superseded'):
+                kept = np.ones(hi - lo, dtype=bool)
+                for first, last in meta['superseded']:
+                    kept &= (timestamps[lo:hi] < first) | (timestamps[lo:hi] > last)
+                rows = lo + np.flatnonzero(kept)
+            data = {'timestamp': timestamps[rows]}
+            for column in columns:
+                path = os.path.join(meta['path'], f"{column}.npy")
+                if os.path.exists(path):
+                    data[column] = np.load(path, mmap_mode='r')[rows]
+            yield meta, data
+
+    def daily_totals(self, column, **query):
+        """
+        Total of a column per run and day.
+
+        Returns:
+        pandas.DataFrame: One row per run and day with the household and the total.
+        """
+        frames = []
+        for meta, data in self.scan([column], **query):
+            if column not in data or not len(data['timestamp']):
+                continue
+            days = np.asarray(data['timestamp']) // NS_PER_DAY
+            unique_days, inverse = np.unique(days, return_inverse=True)
+            totals = np.bincount(inverse, weights=np.asarray(data[column]))
+            frames.append(pd.DataFrame({'run_id': meta['run_id'], 'household': meta['household'],
+                                        'date': pd.to_datetime(unique_days * NS_PER_DAY), column: totals}))
+        if not frames:
+            return pd.DataFrame(columns=['run_id', 'household', 'date', column])
+        return pd.concat(frames, ignore_index=True)
+
+    def percentiles(self, column, q=(5, 25, 50, 75, 95), **query):
+        """
+        Percentiles of a column over all steps of the matching runs.
+
+        Returns:
+        dict: Percentile to value.
+        """
+        values = [np.asarray(data[column]) for _, data in self.scan([column], **query) if column in data]
+        if not values:
+            return {}
+        return dict(zip(q, np.percentile(np.concatenate(values), q).tolist()))
+
+    def household_kpis(self, **query):
+        """
+        Key figures per household over the matching runs.
+
+        Returns:
+        pandas.DataFrame: Per household the number of runs and steps, total demand and
+        generation, self-sufficiency (share of demand covered by its own generation),
+        mean battery charge and mean final currency.
+        """
+        rows = {}
+        for meta, data in self.scan(['energy', 'generation', 'currency', 'battery_charge'], **query):
+            if not len(data['timestamp']):
+                continue
+            energy = np.asarray(data['energy'])
+            generation = np.asarray(data['generation'])
+            row = rows.setdefault(meta['household'], {'runs': 0, 'steps': 0, 'demand': 0.0, 'generation': 0.0,
+                                                      'covered': 0.0, 'battery_sum': 0.0, 'final_currency_sum': 0.0})
+            row['runs'] += 1
+            row['steps'] += len(energy)
+            row['demand'] += float(energy.sum())
+            row['generation'] += float(generation.sum())
+            row['covered'] += float(np.minimum(energy, generation).sum())
+            row['battery_sum'] += float(np.asarray(data['battery_charge']).sum()) if 'battery_charge' in data else 0.0
+            row['final_currency_sum'] += float(data['currency'][-1]) if 'currency' in data else 0.0
+        kpis = pd.DataFrame.from_dict(rows, orient='index')
+        if kpis.empty:
+            return kpis
+        kpis['self_sufficiency'] = kpis['covered'] / kpis['demand'].where(kpis['demand'] > 0)
+        kpis['mean_battery_charge'] = kpis['battery_sum'] / kpis['steps']
+        kpis['mean_final_currency'] = kpis['final_currency_sum'] / kpis['runs']
+        kpis.index.name = 'household'
+        return kpis.drop(columns=['covered', 'battery_sum', 'final_currency_sum'])
+
+def _mark_superseded(metas):
+    # Give each run the time ranges that later runs resumed from the same checkpoint stored again
+    chains = {}
+    for meta in sorted(metas, key=lambda meta: meta['run_id']): # Run IDs start with the time they were stored
+        meta['superseded'] = []
+        if meta.get('checkpoint') is None or meta['rows'] == 0:
+            continue
+        chain = chains.setdefault(meta['checkpoint'], [])
+        if not meta.get('resumed_from'): # A fresh run starts a new chain
+            chain.clear()
+        for earlier in chain:
+            earlier['superseded'].append((meta['start'], meta['end']))
+        chain.append(meta)
@@ -0,0 +1,146 @@
+import threading
+import numpy as np
+
+FACTOR = 4 # Number of buckets of one level merged into one bucket of the next level
+LEVELS = 8 # Level 7 buckets hold 4^7 = 16384 steps, about a year of half hours
+
+class SeriesPyramid:
+    """
+    Min/max/mean pyramid of time series, maintained incrementally as steps arrive.
+
+    Level 0 holds every step, and each bucket of level n + 1 summarises FACTOR
+    buckets of level n. Appending a step updates one open bucket per level in
+    constant time, so a viewer can ask for a year-long run at any resolution
+    without the simulation re-aggregating anything. Missing values (NaN) are
+    ignored by the statistics.
+    """
+
+    def __init__(self, fields, factor=FACTOR, levels=LEVELS):
+        self.fields = list(fields)
+        self.factor = factor
+        self.n_levels = levels
+        self._lock = threading.Lock() # The simulation appends while the server thread reads
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            n_fields = len(self.fields)
+            self._levels = [_Level(n_fields) for _ in range(self.n_levels)]
+            self._open = [_Bucket(n_fields) for _ in range(self.n_levels)] # Bucket being filled on each level
+            self.count = 0
+
+    def append(self, timestamp, values):
+        """
+        Add one step.
+
+        Args:
+        timestamp (int): Time of the step in milliseconds since the epoch.
+        values (sequence): One value per field, NaN if missing.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        with self._lock:
+            self.count += 1
+            self._open[0].add(timestamp, values, values, values, (~np.isnan(values)).astype(np.int64))
+            for level in range(self.n_levels):
+                bucket = self._open[level]
+                if bucket.steps < self.factor ** level:
+                    break
+                # The bucket is complete, store it and pass it up to the next level
+                self._levels[level].append(bucket)
+                if level + 1 < self.n_levels:
+                    self._open[level + 1].merge(bucket)
+                bucket.clear()
+
+    def query(self, fields=None, max_points=1000, start=None, end=None):
+        """
+        Return the series at the finest level with at most max_points buckets in the range.
+
+        Args:
+        fields (list): Fields to return, all by default.
+        max_points (int): Most buckets to return.
+        start (int): Only buckets starting at or after this time (ms).
+        end (int): Only buckets starting before this time (ms).
+
+        Returns:
+        dict: 'level', 'steps_per_point', 'timestamp' and per field 'min', 'max' and 'mean' arrays.
+        """
+        fields = self.fields if fields is None else fields
+        columns = [self.fields.index(field) for field in fields]
+        with self._lock:
+            for level in range(self.n_levels):
+                timestamps, minimum, maximum, total, counts = self._levels[level].view(self._open[level])
+                lo = np.searchsorted(timestamps, start) if start is not None else 0
+                hi = np.searchsorted(timestamps, end) if end is not None else len(timestamps)
+                if hi - lo <= max_points or level == self.n_levels - 1:
+                    break
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total[lo:hi] / counts[lo:hi]
+            result = {'level': level, 'steps_per_point': self.factor ** level, 'timestamp': timestamps[lo:hi].copy()}
+            for field, column in zip(fields, columns):
+                result[field] = {'min': minimum[lo:hi, column].copy(), 'max': maximum[lo:hi, column].copy(),
+                                 'mean': mean[:, column]}
+        return result
+
+class _Bucket:
+    # Running statistics of the bucket being filled
+    def __init__(self, n_fields):
+        self.minimum = np.full(n_fields, np.nan)
+        self.maximum = np.full(n_fields, np.nan)
+        self.total = np.zeros(n_fields)
+        self.counts = np.zeros(n_fields, dtype=np.int64)
+        self.clear()
+
+    def clear(self):
+        self.timestamp = None
+        self.steps = 0
+        self.minimum.fill(np.nan)
+        self.maximum.fill(np.nan)
+        self.total.fill(0.0)
+        self.counts.fill(0)
+
+    def add(self, timestamp, minimum, maximum, total, counts, steps=1):
+        if self.timestamp is None:
+            self.timestamp = timestamp
+        self.steps += steps
+        np.fmin(self.minimum, minimum, out=self.minimum) # fmin and fmax skip NaN
+        np.fmax(self.maximum, maximum, out=self.maximum)
+        self.total += np.nan_to_num(total)
+        self.counts += counts
+
+    def merge(self, other):
+        self.add(other.timestamp, other.minimum, other.maximum, other.total, other.counts, other.steps)
+
+class _Level:
+    # Completed buckets of one level in growable arrays
+    def __init__(self, n_fields, capacity=64):
+        self.size = 0
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.minimum = np.empty((capacity, n_fields))
+        self.maximum = np.empty((capacity, n_fields))
+        self.total = np.empty((capacity, n_fields))
+        self.counts = np.empty((capacity, n_fields), dtype=np.int64)
+
+    def append(self, bucket):
+        if self.size == len(self.timestamps): # Double the capacity when full
+            for name in ('timestamps', 'minimum', 'maximum', 'total', 'counts'):
+                array = getattr(self, name)
+                grown = np.empty((2 * len(array),) + array.shape[1:], dtype=array.dtype)
+                grown[:self.size] = array
+                setattr(self, name, grown)
+        i = self.size
+        self.timestamps[i] = bucket.timestamp
+        self.minimum[i] = bucket.minimum
+        self.maximum[i] = bucket.maximum
+        self.total[i] = bucket.total
+        self.counts[i] = bucket.counts
+        self.size += 1
+
+    def view(self, open_bucket):
+        # Completed buckets followed by the open one, so the latest steps are always visible
+        n = self.size
+        arrays = (self.timestamps[:n], self.minimum[:n], self.maximum[:n], self.total[:n], self.counts[:n])
+        if open_bucket.steps == 0:
+            return arrays
+        return (np.append(arrays[0], open_bucket.timestamp), np.vstack([arrays[1], open_bucket.minimum]),
+                np.vstack([arrays[2], open_bucket.maximum]), np.vstack([arrays[3], open_bucket.total]),
+                np.vstack([arrays[4], open_bucket.counts]))
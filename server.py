@@ -1,8 +1,9 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import logging
 import time
 import threading
-from config import PEER_IP, LOCAL_IP
+import numpy as np
+from seriesPyramid import SeriesPyramid
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,6 +16,11 @@ peers = [] # List of peer IPs
 peer_ready = {} # Dictionary to track readiness of peers
 simulation_started = threading.Event() # Event to signal simulation start
 peer_data = {} # Dictionary to store data from peers
+peer_updated = {} # Monotonic time of each peer's last update
+
+# Series shown on the dashboard, appended to by the simulation every step
+DASHBOARD_FIELDS = ['demand', 'generation', 'balance', 'battery_charge', 'price']
+series_pyramid = SeriesPyramid(DASHBOARD_FIELDS)
 
 # Shared data for energy-related information
 energy_data = {
@@ -46,6 +52,7 @@ def update_peer_data():
     if peer_ip not in peer_data:
         peer_data[peer_ip] = {}
     peer_data[peer_ip].update(data)
+    peer_updated[peer_ip] = time.monotonic()
     logging.info(f"Updated peer data for {peer_ip}: {data}")
     return jsonify({"status": "updated"})
 
@@ -70,16 +77,24 @@ def start():
     return jsonify({"status": "Simulation started"})
 
 start_time = None
+local_resume_step = 0 # Number of steps this Pi has checkpointed, set by main when resuming
+resume_step = 0 # Step both Pis agreed to resume from
+
+# Endpoint for the peer to find out how far this Pi got before a restart
+@app.route('/resume_step', methods=['GET'])
+def get_resume_step():
+    return jsonify({"resume_step": local_resume_step})
 
 @app.route('/sync_start', methods=['POST'])
 def sync_start():
-    global start_time, peers
+    global start_time, peers, resume_step
     data = request.json
     start_time = data.get('start_time')
     peers = data.get('peers', [])
+    resume_step = data.get('resume_step', 0)
     if start_time and peers:
-        logging.info(f"Sync start received. Start time: {start_time}, Peers: {peers}")
-        return jsonify({"status": "start time and peers set", "start_time": start_time, "peers": peers})
+        logging.info(f"Sync start received. Start time: {start_time}, Peers: {peers}, Resume step: {resume_step}")
+        return jsonify({"status": "start time and peers set", "start_time": start_time, "peers": peers, "resume_step": resume_step})
     else:
         logging.warning("Invalid start time or peers in sync_start request")
         return jsonify({"error": "Invalid start time or peers"}), 400
@@ -97,6 +112,11 @@ def start_simulation():
     else:
         return jsonify({"error": "Invalid start time"}), 400
 
+# Endpoint used as a readiness probe once the server is listening
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({"status": "ok"})
+
 @app.route('/get_data', methods=['GET'])
 def get_data():
     global energy_data
@@ -117,5 +137,147 @@ def wait_for_start():
     else:
         return jsonify({"status": "Timeout waiting for simulation to start"}), 408
 
+# This function polls a server's readiness probe until it answers, so callers don't need a fixed sleep
+def wait_for_server(url, timeout=10.0, interval=0.05):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=interval * 10).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass # Not listening yet
+        time.sleep(interval)
+    return False
+
+simulation_clock = None # Clock pacing the running simulation, set by main
+
+# Endpoint to read or change the simulation clock while it runs
+# POST any of: {"speed": 1200}, {"mode": "fast"}, {"catch_up": "skip"}, {"action": "pause" | "resume" | "step"}, {"steps": 5}
+@app.route('/clock', methods=['GET', 'POST'])
+def clock():
+    if simulation_clock is None:
+        return jsonify({"error": "Simulation is not running"}), 409
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            if 'mode' in data:
+                simulation_clock.set_mode(data['mode'])
+            if 'speed' in data:
+                simulation_clock.set_speed(float(data['speed']))
+            if 'catch_up' in data:
+                simulation_clock.set_catch_up(data['catch_up'])
+            action = data.get('action')
+            if action == 'pause':
+                simulation_clock.pause()
+            elif action == 'resume':
+                simulation_clock.resume()
+            elif action == 'step':
+                simulation_clock.step(int(data.get('steps', 1)))
+            elif action is not None:
+                return jsonify({"error": f"Unknown action '{action}'"}), 400
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify(simulation_clock.status())
+
+# Endpoint serving the dashboard series at the requested resolution
+# Query parameters: fields (comma separated), points (most points to return), start and end (ms since the epoch)
+# and format ('json', or 'bin' for little-endian int64 timestamps followed by float32 min, max and mean per field)
+@app.route('/series', methods=['GET'])
+def series():
+    fields = request.args.get('fields', ','.join(DASHBOARD_FIELDS)).split(',')
+    unknown = [field for field in fields if field not in DASHBOARD_FIELDS]
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {unknown}"}), 400
+    try:
+        max_points = min(max(int(request.args.get('points', 1000)), 1), 10000)
+        start = int(request.args['start']) if 'start' in request.args else None
+        end = int(request.args['end']) if 'end' in request.args else None
+    except ValueError:
+        return jsonify({"error": "points, start and end must be integers"}), 400
+    data = series_pyramid.query(fields, max_points, start, end)
+
+    if request.args.get('format') == 'bin':
+        parts = [data['timestamp'].astype('<i8').tobytes()]
+        for field in fields:
+            for stat in ('min', 'max', 'mean'):
+                parts.append(data[field][stat].astype('<f4').tobytes())
+        return Response(b''.join(parts), mimetype='application/octet-stream',
+                        headers={'X-Fields': ','.join(fields), 'X-Points': str(len(data['timestamp'])),
+                                 'X-Steps-Per-Point': str(data['steps_per_point'])})
+
+    def to_list(values):
+        return [None if np.isnan(v) else round(v, 5) for v in values.tolist()] # JSON has no NaN
+    return jsonify({
+        'fields': fields,
+        'steps_per_point': data['steps_per_point'],
+        'timestamp': data['timestamp'].tolist(),
+        **{field: {stat: to_list(data[field][stat]) for stat in ('min', 'max', 'mean')} for field in fields},
+    })
+
+# Lightweight dashboard polling the /series endpoint, drawn on canvases without any external libraries
+@app.route('/dashboard', methods=['GET'])
+def dashboard():
+    return Response(DASHBOARD_HTML, mimetype='text/html')
+
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>SolarVille</title>
+<style>
+  body { font-family: sans-serif; margin: 1em; background: #fafafa; }
+  canvas { width: 100%; height: 160px; background: #fff; border: 1px solid #ddd; margin-bottom: 0.5em; }
+  h3 { margin: 0.3em 0; font-size: 1em; }
+</style>
+</head>
+<body>
+<h2>SolarVille</h2>
+<div id="charts"></div>
+<script>
+const FIELDS = ['demand', 'generation', 'balance', 'battery_charge', 'price'];
+const COLOURS = {demand: '#d33', generation: '#2a2', balance: '#33d', battery_charge: '#e90', price: '#777'};
+const charts = document.getElementById('charts');
+for (const field of FIELDS) {
+  charts.insertAdjacentHTML('beforeend', `<h3>${field}</h3><canvas id="${field}"></canvas>`);
+}
+
+function draw(field, data) {
+  const canvas = document.getElementById(field);
+  const width = canvas.width = canvas.clientWidth, height = canvas.height = canvas.clientHeight;
+  const ctx = canvas.getContext('2d');
+  const series = data[field], n = data.timestamp.length;
+  const values = series.min.concat(series.max).filter(v => v !== null);
+  if (!n || !values.length) return;
+  let lo = Math.min(...values), hi = Math.max(...values);
+  if (hi === lo) { hi += 1; lo -= 1; }
+  const x = i => (n === 1 ? 0.5 : i / (n - 1)) * (width - 10) + 5;
+  const y = v => height - 5 - (v - lo) / (hi - lo) * (height - 10);
+  ctx.fillStyle = COLOURS[field] + '33'; // Min to max band
+  for (let i = 0; i < n; i++) {
+    if (series.min[i] === null) continue;
+    ctx.fillRect(x(i) - 1, y(series.max[i]), 2, Math.max(1, y(series.min[i]) - y(series.max[i])));
+  }
+  ctx.strokeStyle = COLOURS[field]; // Mean line
+  ctx.beginPath();
+  series.mean.forEach((v, i) => { if (v !== null) ctx.lineTo(x(i), y(v)); });
+  ctx.stroke();
+}
+
+async function refresh() {
+  const points = Math.max(100, Math.floor(document.body.clientWidth / 2));
+  try {
+    const response = await fetch(`series?points=${points}`);
+    const data = await response.json();
+    for (const field of FIELDS) draw(field, data);
+  } catch (e) { console.error(e); }
+  setTimeout(refresh, 2000);
+}
+refresh();
+</script>
+</body>
+</html>
+"""
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000)
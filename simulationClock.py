@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+
+MODES = ['realtime', 'scaled', 'fast', 'stepped']
+CATCH_UP_POLICIES = ['slip', 'batch', 'skip']
+
+DEFAULT_SPEED = 600.0 # Simulated seconds per wall second, 6 seconds per simulated hour
+DEFAULT_MAX_LAG = 0.5 # Seconds a step may run late before the catch-up policy applies
+
+class SimulationClock:
+    """
+    Paces the simulation against the wall clock.
+
+    Modes:
+    - realtime: one simulated second per second.
+    - scaled: `speed` simulated seconds per second.
+    - fast: no waiting at all.
+    - stepped: each step waits for step() to be called, e.g. from the /clock endpoint.
+
+    Every step is due at a time computed from a fixed anchor on time.monotonic(),
+    rather than by sleeping for a step's length, so sleep overshoot doesn't add up
+    over a long run. When a step is more than max_lag late the catch-up policy
+    decides what happens:
+    - slip: move the anchor so the late step is on time, later steps keep their spacing.
+    - batch: run the late steps back to back until the simulation is on schedule again.
+    - skip: skip late steps (wait() returns False) until a step is on schedule.
+
+    Waits are interruptible: changing the speed or mode, pausing, resuming,
+    stepping or stopping wakes any waiting step to re-evaluate its due time.
+    """
+
+    def __init__(self, mode='scaled', speed=DEFAULT_SPEED, catch_up='slip', max_lag=DEFAULT_MAX_LAG):
+        if mode not in MODES:
+            raise ValueError(f"Invalid clock mode '{mode}'. Use one of: {', '.join(MODES)}.")
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Invalid catch-up policy '{catch_up}'. Use one of: {', '.join(CATCH_UP_POLICIES)}.")
+        self.mode = mode
+        self.speed = 1.0 if mode == 'realtime' else float(speed)
+        self.catch_up = catch_up
+        self.max_lag = max_lag
+        self._condition = threading.Condition()
+        self._anchor_wall = time.monotonic() # Wall time of the anchor
+        self._anchor_sim = 0.0 # Simulated time at the anchor
+        self._sim_time = 0.0 # Simulated time of the last step let through
+        self._paused_at = None
+        self._step_credits = 0 # Steps allowed by step() in stepped mode
+        self._stopped = False
+        self.overruns = 0 # Steps that ran later than max_lag
+        self.skipped = 0 # Steps skipped by the skip policy
+
+    def start(self, sim_time=0.0):
+        # Anchor the simulated time to now
+        with self._condition:
+            self._anchor_wall = time.monotonic()
+            self._anchor_sim = self._sim_time = sim_time
+            self._condition.notify_all()
+
+    def wait(self, sim_time):
+        """
+        Wait until the step at sim_time (simulated seconds) is due.
+
+        Returns:
+        bool: True to run the step, False if the skip policy drops it.
+        """
+        with self._condition:
+            while not self._stopped:
+                if self._paused_at is not None:
+                    self._condition.wait()
+                    continue
+                if self.mode == 'fast':
+                    break
+                if self.mode == 'stepped':
+                    if self._step_credits > 0:
+                        self._step_credits -= 1
+                        break
+                    self._condition.wait()
+                    continue
+
+                now = time.monotonic()
+                due = self._anchor_wall + (sim_time - self._anchor_sim) / self.speed
+                if now < due:
+                    self._condition.wait(due - now) # Woken early by any control change
+                    continue
+                if now - due > self.max_lag:
+                    self.overruns += 1
+                    if self.catch_up == 'slip':
+                        self._reanchor(now, sim_time)
+                    elif self.catch_up == 'skip':
+                        self.skipped += 1
+                        return False
+                break
+            self._sim_time = sim_time
+            return True
+
+    def _reanchor(self, wall_time, sim_time):
+        self._anchor_wall = wall_time
+        self._anchor_sim = sim_time
+
+    def _current_sim_time(self):
+        # Simulated time the clock has reached, used to change speed without a jump
+        if self.mode in ('fast', 'stepped') or self._paused_at is not None:
+            return self._sim_time
+        return max(self._sim_time, self._anchor_sim + (time.monotonic() - self._anchor_wall) * self.speed)
+
+    def set_speed(self, speed):
+        if speed <= 0:
+            raise ValueError("Speed must be positive")
+        with self._condition:
+            self._reanchor(time.monotonic(), self._current_sim_time())
+            self.speed = float(speed)
+            if self.mode == 'realtime' and speed != 1.0:
+                self.mode = 'scaled'
+            self._condition.notify_all()
+        logging.info(f"Simulation clock speed set to {speed}x")
+
+    def set_mode(self, mode):
+        if mode not in MODES:
+            raise ValueError(f"Invalid clock mode '{mode}'. Use one of: {', '.join(MODES)}.")
+        with self._condition:
+            self._reanchor(time.monotonic(), self._current_sim_time())
+            self.mode = mode
+            if mode == 'realtime':
+                self.speed = 1.0
+            self._condition.notify_all()
+        logging.info(f"Simulation clock mode set to {mode}")
+
+    def set_catch_up(self, catch_up):
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Invalid catch-up policy '{catch_up}'. Use one of: {', '.join(CATCH_UP_POLICIES)}.")
+        with self._condition:
+            self.catch_up = catch_up
+
+    def pause(self):
+        with self._condition:
+            if self._paused_at is None:
+                self._anchor_sim = self._current_sim_time()
+                self._paused_at = time.monotonic()
+                self._anchor_wall = self._paused_at
+                self._condition.notify_all()
+
+    def resume(self):
+        with self._condition:
+            if self._paused_at is not None:
+                self._reanchor(time.monotonic(), self._anchor_sim) # Carry on from where the pause started
+                self._paused_at = None
+                self._condition.notify_all()
+
+    def step(self, steps=1):
+        # Let the next steps through in stepped mode
+        with self._condition:
+            self._step_credits += steps
+            self._condition.notify_all()
+
+    def stop(self):
+        # Release any waiting step, e.g. when shutting down
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def status(self):
+        with self._condition:
+            return {'mode': self.mode, 'speed': self.speed, 'catch_up': self.catch_up, 'paused': self._paused_at is not None,
+                    'sim_time': self._sim_time, 'overruns': self.overruns, 'skipped': self.skipped,
+                    'pending_steps': self._step_credits}
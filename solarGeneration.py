@@ -0,0 +1,183 @@
+import math
+import numpy as np
+
+# Site location used for the sun position (the smart meter data is from London)
+LATITUDE = 51.5 # Degrees north
+LONGITUDE = -0.1 # Degrees east
+
+INTERVAL_SECONDS = 1800 # Length of one meter reading (half an hour)
+SPECIFIC_YIELD = 950.0 # Typical annual yield in the UK (kWh per kWp per year)
+PERFORMANCE_RATIO = 0.8 # Inverter, wiring and soiling losses
+
+# Sky states of the cloud-cover Markov process
+CLEAR, PARTLY_CLOUDY, OVERCAST = 0, 1, 2
+
+# Each weather mode is a Markov chain over the sky states, stepped once per reading.
+# 'transition' rows are the current state and columns the next state.
+# 'transmittance' is the fraction of clear-sky irradiance reaching the panel in each state.
+# 'derate' covers panel temperature losses, which are significant during a heat wave.
+WEATHER_MODES = {
+    'normal': {
+        'transition': [[0.90, 0.08, 0.02],
+                       [0.10, 0.80, 0.10],
+                       [0.03, 0.12, 0.85]],
+        'transmittance': [1.0, 0.6, 0.25],
+        'derate': 1.0,
+    },
+    'heatwave': {
+        'transition': [[0.97, 0.03, 0.00],
+                       [0.25, 0.73, 0.02],
+                       [0.20, 0.30, 0.50]],
+        'transmittance': [1.0, 0.7, 0.3],
+        'derate': 0.88,
+    },
+    'stormy': {
+        'transition': [[0.60, 0.25, 0.15],
+                       [0.05, 0.65, 0.30],
+                       [0.01, 0.07, 0.92]],
+        'transmittance': [0.95, 0.45, 0.12],
+        'derate': 1.0,
+    },
+}
+
+def clear_sky_irradiance(day_of_year, day_seconds, latitude=LATITUDE, longitude=LONGITUDE, interval_seconds=INTERVAL_SECONDS):
+    """
+    Calculate clear-sky global horizontal irradiance for each reading.
+
+    Args:
+    day_of_year (numpy.ndarray): Day of the year (1-366) of each reading.
+    day_seconds (numpy.ndarray): Seconds from midnight at the start of each reading.
+    latitude (float): Site latitude in degrees.
+    longitude (float): Site longitude in degrees.
+    interval_seconds (int): Length of a reading, the sun position is taken at its midpoint.
+
+    Returns:
+    numpy.ndarray: Irradiance in W/m², zero while the sun is below the horizon.
+    """
+    day_of_year = np.asarray(day_of_year, dtype=np.float64)
+    solar_hour = (np.asarray(day_seconds, dtype=np.float64) + interval_seconds / 2) / 3600 + longitude / 15 # Local solar time in hours
+    declination = np.radians(23.45) * np.sin(2 * np.pi * (284 + day_of_year) / 365) # Tilt of the earth towards the sun
+    hour_angle = np.radians(15 * (solar_hour - 12)) # Rotation of the earth since solar noon
+    phi = np.radians(latitude)
+    sin_elevation = np.sin(phi) * np.sin(declination) + np.cos(phi) * np.cos(declination) * np.cos(hour_angle)
+    sin_elevation = np.clip(sin_elevation, 0.0, None) # No irradiance at night
+    with np.errstate(divide='ignore', over='ignore'):
+        irradiance = 1098.0 * sin_elevation * np.exp(-0.057 / sin_elevation) # Haurwitz clear-sky model
+    return np.nan_to_num(irradiance)
+
+def cloud_cover(n_steps, weather='normal', rng=None):
+    """
+    Simulate the sky state for each reading with the Markov chain of a weather mode.
+
+    The chain is simulated jump by jump, drawing how long each state lasts from a
+    geometric distribution, so the cost grows with the number of weather changes
+    rather than the number of readings.
+
+    Args:
+    n_steps (int): Number of readings to simulate.
+    weather (str): Weather mode, one of WEATHER_MODES.
+    rng (numpy.random.Generator): Random number generator.
+
+    Returns:
+    numpy.ndarray: Sky state (CLEAR, PARTLY_CLOUDY or OVERCAST) of each reading.
+    """
+    if weather not in WEATHER_MODES:
+        raise ValueError(f"Invalid weather mode '{weather}'. Use one of: {', '.join(WEATHER_MODES)}.")
+    rng = rng if rng is not None else np.random.default_rng()
+    transition = np.asarray(WEATHER_MODES[weather]['transition'])
+    n_states = transition.shape[0]
+    stay = np.diag(transition) # Probability of staying in each state for another reading
+    jump = transition * (1 - np.eye(n_states)) # Probability of each state change
+    jump = jump / jump.sum(axis=1, keepdims=True)
+
+    # Start from the stationary distribution of the chain
+    eigenvalues, eigenvectors = np.linalg.eig(transition.T)
+    stationary = np.abs(np.real(eigenvectors[:, np.argmin(np.abs(eigenvalues - 1))]))
+    state = int(rng.choice(n_states, p=stationary / stationary.sum()))
+
+    # Each jump lasts at least one reading, so n_steps random draws are always enough
+    log_stay = np.log(stay).tolist()
+    cumulative_jump = np.cumsum(jump, axis=1).tolist()
+    duration_draws = rng.random(n_steps).tolist()
+    next_draws = rng.random(n_steps).tolist()
+
+    states = []
+    durations = []
+    filled = 0
+    while filled < n_steps:
+        duration = 1 + int(math.log(1 - duration_draws[len(states)]) / log_stay[state]) # Geometric holding time
+        draw = next_draws[len(states)]
+        states.append(state)
+        durations.append(duration)
+        filled += duration
+        state = next(i for i, p in enumerate(cumulative_jump[state]) if draw < p or i == n_states - 1)
+    return np.repeat(np.array(states, dtype=np.int8), durations)[:n_steps]
+
+def size_panels(annual_demand, coverage=0.8, specific_yield=SPECIFIC_YIELD):
+    """
+    Size the solar panels of each household from its annual demand.
+
+    Args:
+    annual_demand (float or numpy.ndarray): Annual demand in kWh.
+    coverage (float): Fraction of the annual demand the panels should generate.
+    specific_yield (float): Annual generation per kWp installed.
+
+    Returns:
+    float or numpy.ndarray: Panel size in kWp.
+    """
+    return coverage * np.asarray(annual_demand, dtype=np.float64) / specific_yield
+
+def generate_solar(day_of_year, day_seconds, panel_kwp, weather='normal', seed=42, variability=0.1):
+    """
+    Generate solar energy for one or more households over a whole date range at once.
+
+    All households share the weather of the neighbourhood, with a small independent
+    variation per household for passing clouds and panel orientation.
+
+    Args:
+    day_of_year (numpy.ndarray): Day of the year of each reading.
+    day_seconds (numpy.ndarray): Seconds from midnight at the start of each reading.
+    panel_kwp (float or numpy.ndarray): Panel size in kWp, one value per household.
+    weather (str): Weather mode, one of WEATHER_MODES.
+    seed (int): Seed for the random number generator.
+    variability (float): Standard deviation of the per-household variation.
+
+    Returns:
+    numpy.ndarray: Energy generated in kWh per reading, shape (readings,) for a
+    single household or (readings, households) for several.
+    """
+    rng = np.random.default_rng(seed)
+    mode = WEATHER_MODES.get(weather)
+    irradiance = clear_sky_irradiance(day_of_year, day_seconds)
+    n_steps = irradiance.shape[0]
+    sky = cloud_cover(n_steps, weather, rng)
+    transmittance = np.asarray(mode['transmittance'])[sky] * mode['derate']
+    panel_kwp = np.asarray(panel_kwp, dtype=np.float64)
+    hours = INTERVAL_SECONDS / 3600
+
+    # kW per kWp is irradiance in kW/m² relative to the 1 kW/m² panel rating
+    profile = (irradiance * transmittance / 1000 * PERFORMANCE_RATIO * hours).astype(np.float32)
+    energy = profile[:, np.newaxis] * np.atleast_1d(panel_kwp).astype(np.float32)
+    if variability > 0:
+        # Each household reads the same noise sequence from a random offset, which is
+        # much cheaper than drawing readings x households independent samples
+        pool = 1 + variability * rng.standard_normal(2 * n_steps, dtype=np.float32)
+        offsets = rng.integers(0, n_steps + 1, energy.shape[1])
+        noise = np.lib.stride_tricks.sliding_window_view(pool, n_steps)[offsets].T
+        energy *= np.clip(noise, 0.0, None)
+    return energy[:, 0] if panel_kwp.ndim == 0 else energy
+
+if __name__ == "__main__": # Benchmark a year of generation for a street of households
+    import time
+    import pandas as pd # type: ignore
+
+    index = pd.date_range('2013-01-01', periods=365 * 48, freq='30min')
+    day_seconds = (index - index.normalize()).total_seconds().to_numpy()
+    households = 500
+    panel_kwp = size_panels(np.random.default_rng(0).uniform(2000, 5000, households))
+    for weather in WEATHER_MODES:
+        start_time = time.perf_counter()
+        energy = generate_solar(index.dayofyear.to_numpy(), day_seconds, panel_kwp, weather=weather)
+        elapsed = time.perf_counter() - start_time
+        print(f"{weather:>8}: {households} households x {len(index)} readings in {elapsed * 1000:.1f} ms, "
+              f"mean yield {energy.sum(axis=0).mean() / panel_kwp.mean():.0f} kWh/kWp")
@@ -0,0 +1,62 @@
+# Benchmark the startup of the simulation: module import time and server readiness
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# Modules loaded before the first step, leaving out the Raspberry Pi hardware modules
+# server (Flask) and requests, used by wait_for_server, are needed before the first step too
+STARTUP_MODULES = ['dataAnalysis', 'solarGeneration', 'batteryOptimiser', 'pricing', 'trading', 'liveMeter',
+                   'energyMeter', 'resultsStore', 'simulationClock', 'peerLink', 'community', 'checkpoint', 'config',
+                   'lazyImport', 'server', 'requests']
+# Modules main.py used to import eagerly and now only loads once they are needed
+EAGER_MODULES = ['matplotlib.pyplot', 'matplotlib.dates']
+
+RUNS = 5
+FIXED_SLEEP = 2.0 # Seconds main.py used to wait for the server
+
+def time_import(modules, runs=RUNS):
+    # Median wall time to import the modules in a fresh interpreter
+    statement = 'import ' + ', '.join(modules)
+    times = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True)
+        times.append(time.perf_counter() - start_time)
+    return statistics.median(times)
+
+def time_server_ready():
+    # Seconds from starting the server thread until the readiness probe answers
+    from server import app, wait_for_server
+    with socket.socket() as s: # Find a free port
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    start_time = time.perf_counter()
+    threading.Thread(target=app.run, kwargs={'host': 'localhost', 'port': port}, daemon=True).start()
+    if not wait_for_server(f'http://localhost:{port}/health'):
+        raise RuntimeError("Server did not start")
+    return time.perf_counter() - start_time
+
+def time_discovery():
+    from config import discover_ips
+    start_time = time.perf_counter()
+    discover_ips()
+    first = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    discover_ips()
+    return first, time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    baseline = time_import(['sys'])
+    lazy = time_import(STARTUP_MODULES) - baseline
+    eager = time_import(STARTUP_MODULES + EAGER_MODULES) - baseline
+    print(f"Startup imports:         {lazy * 1000:7.1f} ms")
+    print(f"With eager imports:      {eager * 1000:7.1f} ms ({(eager - lazy) * 1000:.1f} ms saved)")
+
+    first, cached = time_discovery()
+    print(f"IP discovery:            {first * 1000:7.1f} ms first call, {cached * 1e6:.1f} µs cached")
+
+    ready = time_server_ready()
+    print(f"Server ready after:      {ready * 1000:7.1f} ms (previously a fixed {FIXED_SLEEP * 1000:.0f} ms sleep)")
@@ -1,3 +1,5 @@
+from pricing import linear_price
+
 def execute_trades(df, timestamp):
     sellers = df[df['balance'] > 0].copy()
     buyers = df[df['balance'] < 0].copy()
@@ -30,9 +32,21 @@ def execute_trades(df, timestamp):
     return df, price
 
 def calculate_price(supply, demand):
-    base_price = 0.10  # Base price per kWh in pounds
-    if demand > 0 and supply > 0:
-        price = base_price * (demand / supply)
-    else:
-        price = base_price
-    return max(price, 0.01)  # Ensure the price is never below 0.01
\ No newline at end of file
+    # Scalar form of pricing.linear_price, the price is never below 0.01
+    return float(linear_price(supply, demand))
+
+def bilateral_trade(balance, peer_balance, price=None):
+    """
+    Settle one step of trading between this household and its peer.
+
+    Returns the energy traded (positive when this household sells, negative when it
+    buys) and the price per kWh, or (0.0, 0.0) if there is nothing to trade. The
+    price follows the two balances unless the peer sets it, as a community does.
+    """
+    if balance > 0 and peer_balance < 0: # Local surplus and peer deficit, sell
+        trade_amount = min(balance, abs(peer_balance))
+        return trade_amount, calculate_price(balance, abs(peer_balance)) if price is None else price
+    if balance < 0 and peer_balance > 0: # Local deficit and peer surplus, buy
+        trade_amount = min(abs(balance), peer_balance)
+        return -trade_amount, calculate_price(peer_balance, abs(balance)) if price is None else price
+    return 0.0, 0.0
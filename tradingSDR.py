@@ -1,3 +1,6 @@
+import logging
+from pricing import sdr_price
+
 def execute_trades(df, timestamp):
     sellers = df[df['balance'] > 0].copy()
     buyers = df[df['balance'] < 0].copy()
@@ -30,18 +33,7 @@ def execute_trades(df, timestamp):
     return df, price
 
 def calculate_price(supply, demand):
-    p_min = 0.10
-    p_max = 1.0
-    base_price = (p_min + p_max)/2   # Base price per kWh in pounds
-    sdr = supply/demand
-    print(f"Calculating price: supply = {supply:.2f}, demand = {demand:.2f}, SDR = {sdr:.2f}")  # Debug print
-    if demand > 0 and supply > 0:
-        if price > p_min and price < p_max:
-            price = base_price * (1 / sdr)
-        else: 
-            print("Trading is not profitable")
-    else:
-        price = base_price
-    price = max(price, 0)  # Ensure the price is non-negative
-    print(f"Calculated price: {price:.2f}")  # Debug print
-    return price
\ No newline at end of file
+    # Scalar form of pricing.sdr_price, clamped to the range p_min to p_max
+    price = float(sdr_price(supply, demand))
+    logging.debug(f"Calculated price: supply = {supply:.2f}, demand = {demand:.2f}, price = {price:.2f}")
+    return price